@@ -4,14 +4,18 @@ import os
 load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
 
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+import json
 from pydantic import BaseModel
 from typing import Dict
 from langchain_core.messages import HumanMessage, AIMessage
 from fastapi.middleware.cors import CORSMiddleware
 from setup_graph import GraphManager, GraphManagerEval, State, INIT_MESSAGE
 # from langgraph.graph.message import add_messages
-from langchain.chat_models import init_chat_model
-from setup_graph import talk_to_agent
+from setup_graph import atalk_to_agent, astream_to_agent
+from sessions import SessionStore
+from session_backend import SessionConflict
+from fast_intent import get_fast_intent_classifier
 
 app = FastAPI(title="4 mousquet'AIres", description="Backend with Langchain & Langgraph AI Agent")
 
@@ -24,10 +28,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-MISTRAL_MODEL = os.getenv('MISTRAL_MODEL', 'mistral-medium-latest')
-
-model = init_chat_model(MISTRAL_MODEL, model_provider="mistralai")
-state : State = State()
+# Une conversation (State) par session_id
+sessions = SessionStore()
 mgr = GraphManager()
 mgreval = GraphManagerEval()
 class ChatMessage(BaseModel):
@@ -47,14 +49,14 @@ class EvaluationResponse(BaseModel):
 
 
 @app.post("/chat", response_model=EvaluationResponse)
-def chat_evaluation(request: EvaluationRequest):
+async def chat_evaluation(request: EvaluationRequest):
     """
     Endpoint dédié pour l'évaluation - comportement stateless
     Accepte {"question": "..."} et retourne {"answer": "..."}
     """
     try:
         # Pas de gestion de session pour l'évaluation - comportement stateless
-        ai_response = talk_to_agent(state, mgreval, request.question)
+        ai_response = await atalk_to_agent(State(), mgreval, request.question)
 
         # Extraire le texte de la réponse si c'est un objet SpecificInfoOutput
         if hasattr(ai_response, 'response'):
@@ -70,13 +72,17 @@ def chat_evaluation(request: EvaluationRequest):
         raise HTTPException(status_code=500, detail=f"Erreur de l'agent: {str(e)}")
 
 @app.post("/", response_model=ChatResponse)
-def chat_with_agent(chat_message: ChatMessage):
+async def chat_with_agent(chat_message: ChatMessage):
     try:
                 
         # Construire la liste des messages avec l'historique + nouveau message
         # messages = chat_history + [HumanMessage(content=chat_message.message)]
         # Invoquer le modèle avec tout l'historique
-        ai_response = talk_to_agent(state, mgr, chat_message.message)
+        # Tours d'une même session traités l'un après l'autre, doublons fusionnés
+        ai_response = await sessions.run_turn(
+            chat_message.session_id, chat_message.message,
+            lambda state: atalk_to_agent(state, mgr, chat_message.message),
+        )
 
         # Extraire le texte de la réponse si c'est un objet SpecificInfoOutput
         if hasattr(ai_response, 'response'):
@@ -89,18 +95,59 @@ def chat_with_agent(chat_message: ChatMessage):
         
         return ChatResponse(response=ai_message, session_id=chat_message.session_id)
         
+    except SessionConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erreur de l'agent: {str(e)}")
     
-
-# @app.get("/chat/sessions")
-# def get_chat_sessions():
-#     return {"sessions": chat_sessions}
-
-# @app.delete("/chat/sessions/{session_id}")
-# def clear_chat_session(session_id: str):
-#     if session_id in chat_sessions:
-#         del chat_sessions[session_id]
-#         return {"message": f"Session {session_id} supprimée"}
-#     else:
-#         raise HTTPException(status_code=404, detail="Session non trouvée")
\ No newline at end of file
+@app.post("/stream")
+async def stream_chat_with_agent(chat_message: ChatMessage):
+    """
+    Même conversation que POST /, en Server-Sent Events : progression des noeuds,
+    morceaux de la réponse au fil de l'eau, puis un événement "done" avec la réponse complète
+    """
+    async def events():
+        try:
+            turn = sessions.stream_turn(
+                chat_message.session_id, chat_message.message,
+                lambda state: astream_to_agent(state, mgr, chat_message.message),
+            )
+            async for event in turn:
+                if event["event"] == "done":
+                    event["session_id"] = chat_message.session_id
+                yield f"event: {event['event']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        except Exception as e:
+            error = {"event": "error", "detail": f"Erreur de l'agent: {str(e)}"}
+            yield f"event: error\ndata: {json.dumps(error, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # Pas de mise en tampon côté proxy (nginx) ni de cache
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.on_event("shutdown")
+def close_sessions():
+    sessions.close()
+
+@app.get("/stats")
+def get_stats():
+    fast_classifier = get_fast_intent_classifier()
+    return {
+        "sessions": sessions.info(),
+        "fast_intent": fast_classifier.info() if fast_classifier is not None else None,
+        "speculation": mgr.speculator.info(),
+    }
+
+@app.get("/chat/sessions")
+def get_chat_sessions():
+    return sessions.info()
+
+@app.delete("/chat/sessions/{session_id}")
+def clear_chat_session(session_id: str):
+    if sessions.delete(session_id):
+        return {"message": f"Session {session_id} supprimée"}
+    else:
+        raise HTTPException(status_code=404, detail="Session non trouvée")
@@ -0,0 +1,64 @@
+"""
+Micro-benchmark : surcoût par requête de talk_to_agent avec un graphe recompilé
+à chaque tour (ancien comportement) ou compilé une seule fois (GraphManager.app)
+
+Les agents sont remplacés par des réponses fixes : seul le coût LangGraph est mesuré
+Utilisation : python bench_graph.py [nombre de tours]
+"""
+import contextlib
+import io
+import os
+import sys
+import time
+
+os.environ.setdefault('MISTRAL_API_KEY', 'bench')
+
+from langchain_core.messages import AIMessage
+from setup_graph import GraphManager, State, talk_to_agent
+
+
+def stub_manager():
+    mgr = GraphManager()
+    mgr.agent.get_user_intent = lambda state: {
+        "user_wants_road_in_versailles": False,
+        "user_wants_specific_info": True,
+        "user_asks_off_topic": False,
+    }
+    mgr.specificInfoAgent.get_necessary_info = lambda state: {"messages": AIMessage(content="ok")}
+    mgr.app = mgr.create_workflow().compile()
+    return mgr
+
+
+class RecompilingManager():
+    """Ancien comportement : create_workflow().compile() à chaque tour"""
+    def __init__(self, mgr):
+        self.mgr = mgr
+
+    def run_agent(self, state):
+        return self.mgr.create_workflow().compile().invoke(state)
+
+
+def bench(mgr, turns):
+    state = State()
+    start = time.perf_counter()
+    for _ in range(turns):
+        talk_to_agent(state, mgr, "Bonjour")
+        # L'historique ne doit pas grossir pendant la mesure
+        state = State()
+    return (time.perf_counter() - start) / turns
+
+
+if __name__ == "__main__":
+    turns = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    mgr = stub_manager()
+    # talk_to_agent affiche chaque réponse : sortie masquée pendant la mesure
+    with contextlib.redirect_stdout(io.StringIO()):
+        # Échauffement
+        bench(mgr, 5)
+        bench(RecompilingManager(mgr), 5)
+        cached = bench(mgr, turns)
+        recompiled = bench(RecompilingManager(mgr), turns)
+
+    print(f"Graphe recompilé à chaque tour : {recompiled * 1e3:.2f} ms/tour")
+    print(f"Graphe compilé une fois        : {cached * 1e3:.2f} ms/tour")
+    print(f"Surcoût supprimé               : {(recompiled - cached) * 1e3:.2f} ms/tour")
@@ -0,0 +1,97 @@
+"""
+Découpage des pages du crawl en chunks alignés sur les titres de section
+
+L'arbre `content` (section / heading / content_block / list / text) est parcouru
+une seule fois ; les chunks sont produits au fil de l'eau (générateur) avec le
+chemin de titres de la section où ils commencent
+"""
+import os
+from embedding import split_text
+
+CHUNK_CHARS = int(os.getenv('INDEX_CHUNK_CHARS', 2000))
+CHUNK_OVERLAP = int(os.getenv('INDEX_CHUNK_OVERLAP', 200))
+# Une section plus courte que ça est fusionnée avec la suivante plutôt que de faire un chunk seule
+MIN_CHUNK_CHARS = int(os.getenv('INDEX_MIN_CHUNK_CHARS', 800))
+
+
+class SectionChunker():
+    def __init__(self, max_chars=CHUNK_CHARS, min_chars=MIN_CHUNK_CHARS, overlap=CHUNK_OVERLAP):
+        self.max_chars = max_chars
+        self.min_chars = min_chars
+        self.overlap = overlap
+        self.parts = []
+        self.size = 0
+        self.path = []
+
+    def chunks(self, content):
+        """
+        Générateur de chunks {"heading_path": [...], "text": "..."}
+        """
+        yield from self._walk(content, [])
+        yield from self._flush(force=True)
+
+    def _flush(self, force=False):
+        if self.parts and (force or self.size >= self.min_chars):
+            yield {"heading_path": self.path, "text": '\n'.join(self.parts)}
+            self.parts, self.size = [], 0
+
+    def _add(self, text, path):
+        text = ' '.join(text.split())
+        if not text:
+            return
+        if self.parts and self.size + len(text) + 1 > self.max_chars:
+            yield from self._flush(force=True)
+
+        # Paragraphe trop long pour un seul chunk : découpage avec chevauchement
+        if len(text) > self.max_chars:
+            yield from self._flush(force=True)
+            for piece in split_text(text, self.max_chars, self.overlap):
+                yield {"heading_path": list(path), "text": piece}
+            return
+
+        if not self.parts:
+            self.path = list(path)
+        self.parts.append(text)
+        self.size += len(text) + 1
+
+    def _walk(self, node, path):
+        if isinstance(node, str):
+            yield from self._add(node, path)
+
+        elif isinstance(node, list):
+            for item in node:
+                yield from self._walk(item, path)
+
+        elif isinstance(node, dict):
+            heading = node.get('heading')
+            if isinstance(heading, dict):
+                # Nouvelle section : frontière de chunk
+                yield from self._flush()
+                title = ' '.join(heading.get('text', '').split())
+                section_path = path + [title] if title else path
+                yield from self._add(title, section_path)
+                yield from self._walk(node.get('content', []), section_path)
+                yield from self._flush()
+                return
+
+            if node.get('type') == 'list':
+                for item in node.get('items', []):
+                    if isinstance(item, str):
+                        yield from self._add(f"- {item}", path)
+                    else:
+                        yield from self._walk(item, path)
+                return
+
+            if isinstance(node.get('text'), str):
+                yield from self._add(node['text'], path)
+            if 'content' in node:
+                yield from self._walk(node['content'], path)
+            if 'items' in node:
+                yield from self._walk(node['items'], path)
+
+
+def iter_chunks(content, max_chars=CHUNK_CHARS, min_chars=MIN_CHUNK_CHARS):
+    """
+    Découpe l'arbre `content` d'une page en chunks alignés sur les sections
+    """
+    return SectionChunker(max_chars=max_chars, min_chars=min_chars).chunks(content)
@@ -1,79 +1,163 @@
-from embedding import embed_query, extract_text_from_content
+from embedding import split_text, extract_text_from_content
+from embedding_pipeline import embed_texts_async
+from store import save_store, store_prefix, DEFAULT_STORE
+import numpy as np
 import json
+import os
+import sys
 
-def create_documents(file):
-    documents = []
-    # Lecture et parsing du fichier
+def document_to_text(document):
+    """
+    Extrait le contenu textuel selon la structure du document
+    """
+    if "texte" in document:
+        # Structure des conseils : {"id": "...", "texte": "..."}
+        text_content = document["texte"]
+        return f"ID: {document.get('id', '')}\n{text_content}"
+    elif "content" in document:
+        # Structure originale avec content
+        content = document.get("content", [])
+        text_content = extract_text_from_content(content)
+        return f"URL: {document.get('url', '')}\nTitre: {document.get('title', '')}\n\n{text_content}"
+    # Fallback : convertir tout le document en texte
+    return json.dumps(document, ensure_ascii=False)
+
+def _iter_json_array(f, buffer, chunk_size=1 << 16):
+    """
+    Parcourt un tableau JSON élément par élément sans charger tout le fichier
+    `buffer` contient le début du fichier déjà lu, à partir du '['
+    """
+    decoder = json.JSONDecoder()
+    position = 1  # après le '['
+    while True:
+        # Sauter les espaces et les virgules entre les éléments
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position < len(buffer):
+                break
+            more = f.read(chunk_size)
+            if not more:
+                return
+            buffer, position = more, 0
+
+        if buffer[position] == ']':
+            return
+        try:
+            document, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # Élément incomplet : lire la suite
+            more = f.read(chunk_size)
+            if not more:
+                raise
+            buffer, position = buffer[position:] + more, 0
+            continue
+        yield document
+        buffer, position = buffer[end:], 0
+
+def _iter_documents_from_data(data):
+    # Vérifier si c'est un objet avec une clé "conseils"
+    if isinstance(data, dict) and "conseils" in data:
+        # Traiter chaque conseil comme un document séparé
+        yield from data["conseils"]
+    # Sinon, si c'est déjà une liste de documents
+    elif isinstance(data, list):
+        yield from data
+    # Sinon, traiter comme un seul document
+    else:
+        yield data
+
+def iter_documents(file):
+    """
+    Générateur de documents. Le format est détecté sur le début du fichier :
+    - tableau JSON : lu élément par élément
+    - JSONL (une première ligne qui est un objet complet) : lu ligne par ligne
+    - objet {"conseils": [...]}, sur une ou plusieurs lignes : ses conseils
+    - autre objet JSON sur plusieurs lignes : chargé en entier
+    """
     with open(file, 'r', encoding='utf-8') as f:
+        first_line = f.readline()
+        while first_line and not first_line.strip():
+            first_line = f.readline()
+        head = first_line.lstrip()
+        if not head:
+            return
+
+        if head.startswith('['):
+            yield from _iter_json_array(f, head)
+            return
+
         try:
-            # Charger tout le fichier JSON d'un coup
-            data = json.load(f)
-
-            # Vérifier si c'est un objet avec une clé "conseils"
-            if isinstance(data, dict) and "conseils" in data:
-                # Traiter chaque conseil comme un document séparé
-                for conseil in data["conseils"]:
-                    documents.append(conseil)
-            # Sinon, si c'est déjà une liste de documents
-            elif isinstance(data, list):
-                documents = data
-            # Sinon, traiter comme un seul document
-            else:
-                documents.append(data)
-
-        except json.JSONDecodeError as e:
-            print(f"Erreur de décodage JSON du fichier complet : {e}")
-            # Fallback : essayer de lire ligne par ligne (format JSONL)
-            f.seek(0)  # Retourner au début du fichier
-            for ligne in f:
-                ligne = ligne.strip()
-                if not ligne:  # Ignorer les lignes vides
-                    continue
-                try:
-                    doc = json.loads(ligne)
-                    documents.append(doc)
-                except json.JSONDecodeError as e:
-                    print(f"Erreur de décodage JSON ligne : {e}")
-                    continue
-    
+            first_document = json.loads(head)
+        except json.JSONDecodeError:
+            first_document = None
+
+        if first_document is None:
+            # Objet JSON sur plusieurs lignes
+            f.seek(0)
+            yield from _iter_documents_from_data(json.load(f))
+            return
+
+        # JSONL ; une première ligne {"conseils": [...]} (fichier compact) donne ses conseils
+        yield from _iter_documents_from_data(first_document)
+        for ligne in f:
+            ligne = ligne.strip()
+            if not ligne:  # Ignorer les lignes vides
+                continue
+            try:
+                yield json.loads(ligne)
+            except json.JSONDecodeError as e:
+                print(f"Erreur de décodage JSON ligne : {e}")
+                continue
+
+def load_documents(file):
+    return list(iter_documents(file))
+
+def embed_documents(documents):
+    """
+    Ajoute un champ "embedding" à chaque document
+    """
     # Embedding des documents
     print(f"Embedding de {len(documents)} documents...")
-    for i, document in enumerate(documents):
-        # Extraire le contenu textuel selon la structure du document
-        if "texte" in document:
-            # Structure des conseils : {"id": "...", "texte": "..."}
-            text_content = document["texte"]
-            full_text = f"ID: {document.get('id', '')}\n{text_content}"
-        elif "content" in document:
-            # Structure originale avec content
-            content = document.get("content", [])
-            text_content = extract_text_from_content(content)
-            full_text = f"URL: {document.get('url', '')}\nTitre: {document.get('title', '')}\n\n{text_content}"
-        else:
-            # Fallback : convertir tout le document en texte
-            full_text = json.dumps(document, ensure_ascii=False)
-
-        document["embedding"] = embed_query(full_text)
-
-        if (i + 1) % 10 == 0:  # Afficher tous les 10 car l'API peut être lente
-            print(f"  {i + 1}/{len(documents)} documents traités")
-    
+    full_texts = [document_to_text(document) for document in documents]
+
+    # Les documents longs sont découpés ; tous les morceaux partent en requêtes groupées et parallèles
+    chunks_per_doc = [split_text(text) for text in full_texts]
+    all_chunks = [chunk for chunks in chunks_per_doc for chunk in chunks]
+    all_embeddings = embed_texts_async(all_chunks)
+
+    position = 0
+    for document, chunks in zip(documents, chunks_per_doc):
+        embeddings = all_embeddings[position:position + len(chunks)]
+        position += len(chunks)
+        # Moyenner les embeddings des documents découpés
+        document["embedding"] = embeddings[0] if len(embeddings) == 1 else np.mean(embeddings, axis=0).tolist()
+
     return documents
 
+def create_documents(file):
+    return embed_documents(load_documents(file))
+
 def save_documents(documents, output_file=None):
     """
-    Sauvegarde les documents avec leurs embeddings dans un fichier JSON (liste)
+    Sauvegarde les documents avec leurs embeddings dans un fichier JSON (liste),
+    ainsi qu'un store binaire (.npy + .meta.json) chargé en mmap au démarrage
     """
     if output_file is None:
-        output_file = f'data/documents_embedded.json'
+        # Même store que celui chargé par setup_graph au démarrage
+        output_file = store_prefix(os.getenv('EMBEDDINGS_STORE', DEFAULT_STORE)) + '.json'
 
     with open(output_file, 'w', encoding='utf-8') as f:
         json.dump(documents, f, ensure_ascii=False, indent=2)
 
-    print(f"✅ {len(documents)} documents sauvegardés dans {output_file}")
+    matrix_path, meta_path = save_store(documents, output_file)
+
+    print(f"✅ {len(documents)} documents sauvegardés dans {output_file}, {matrix_path} et {meta_path}")
     return output_file
 
 # Utilisation
 if __name__ == "__main__":
-    documents = create_documents("data/tips.json")
-    save_documents(documents, "data/tips_embedded.json")
+    # python create_db.py [fichier source] [store de sortie]
+    source = sys.argv[1] if len(sys.argv) > 1 else "data/tips.json"
+    documents = create_documents(source)
+    save_documents(documents, sys.argv[2] if len(sys.argv) > 2 else None)
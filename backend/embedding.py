@@ -1,4 +1,5 @@
 from dotenv import load_dotenv
+import asyncio
 import os
 import numpy as np
 # from sentence_transformers import SentenceTransformer
@@ -7,7 +8,14 @@ from mistralai import Mistral
 load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
 EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'mistral-embed')
 
+# Limites de l'API d'embedding : 8192 tokens par entrée, ~16k tokens par requête
+MAX_BATCH_TOKENS = int(os.getenv('EMBEDDING_MAX_BATCH_TOKENS', 16000))
+MAX_BATCH_SIZE = int(os.getenv('EMBEDDING_MAX_BATCH_SIZE', 128))
+MAX_CHARS = 20000
+OVERLAP = 1000
+
 client = None
+embedding_cache = None
 
 def get_mistral_client():
     global client
@@ -21,6 +29,118 @@ def get_mistral_client():
         client = Mistral(api_key=api_key)
     return client
 
+def get_embedding_cache():
+    """
+    Cache disque des embeddings (désactivé si EMBEDDING_CACHE_PATH est vide)
+    """
+    global embedding_cache
+    if embedding_cache is None:
+        from embedding_cache import EmbeddingCache, DEFAULT_CACHE_PATH
+        path = os.getenv('EMBEDDING_CACHE_PATH', DEFAULT_CACHE_PATH)
+        embedding_cache = EmbeddingCache(path) if path else False
+    return embedding_cache if embedding_cache is not False else None
+
+def estimate_tokens(text):
+    """
+    Estimation prudente du nombre de tokens (~3 caractères par token)
+    """
+    return len(text) // 3 + 1
+
+def make_batches(texts, max_tokens=None, max_size=None):
+    """
+    Regroupe les textes en lots qui respectent les limites de l'API (tokens et nombre d'entrées)
+    Retourne une liste de listes d'indices
+    """
+    max_tokens = max_tokens or MAX_BATCH_TOKENS
+    max_size = max_size or MAX_BATCH_SIZE
+    batches, current, current_tokens = [], [], 0
+    for i, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if current and (current_tokens + tokens > max_tokens or len(current) >= max_size):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def embed_batch(texts):
+    """
+    Un seul appel API pour un lot de textes, avec le client partagé
+    """
+    response = get_mistral_client().embeddings.create(model=EMBEDDING_MODEL, inputs=texts)
+    data = sorted(response.data, key=lambda d: d.index)
+    return [d.embedding for d in data]
+
+async def aembed_batch(texts):
+    response = await get_mistral_client().embeddings.create_async(model=EMBEDDING_MODEL, inputs=texts)
+    data = sorted(response.data, key=lambda d: d.index)
+    return [d.embedding for d in data]
+
+def embed_texts(texts):
+    """
+    Embedding d'une liste de textes : cache d'abord, puis requêtes groupées pour les manquants
+    """
+    cache = get_embedding_cache()
+    results = cache.get_many(EMBEDDING_MODEL, texts) if cache is not None else [None] * len(texts)
+
+    missing = [i for i, r in enumerate(results) if r is None]
+    if not missing:
+        return results
+
+    missing_texts = [texts[i] for i in missing]
+    batches = make_batches(missing_texts)
+    print(f"Embedding de {len(missing_texts)} textes en {len(batches)} requêtes")
+    for batch in batches:
+        batch_texts = [missing_texts[j] for j in batch]
+        embeddings = embed_batch(batch_texts)
+        if cache is not None:
+            cache.put_many(EMBEDDING_MODEL, batch_texts, embeddings)
+        for j, embedding in zip(batch, embeddings):
+            results[missing[j]] = embedding
+    return results
+
+async def aembed_texts(texts):
+    """
+    Version asynchrone de embed_texts (chemin des requêtes FastAPI).
+    Le cache SQLite est lu et écrit dans un thread, sans bloquer la boucle d'événements
+    """
+    cache = get_embedding_cache()
+    results = await asyncio.to_thread(cache.get_many, EMBEDDING_MODEL, texts) if cache is not None else [None] * len(texts)
+
+    missing = [i for i, r in enumerate(results) if r is None]
+    missing_texts = [texts[i] for i in missing]
+    for batch in make_batches(missing_texts) if missing else []:
+        batch_texts = [missing_texts[j] for j in batch]
+        embeddings = await aembed_batch(batch_texts)
+        if cache is not None:
+            await asyncio.to_thread(cache.put_many, EMBEDDING_MODEL, batch_texts, embeddings)
+        for j, embedding in zip(batch, embeddings):
+            results[missing[j]] = embedding
+    return results
+
+def split_text(text, max_chars=MAX_CHARS, overlap=OVERLAP):
+    """
+    Découpe un texte long en morceaux qui se chevauchent
+    """
+    if len(text) <= max_chars:
+        return [text]
+
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = start + max_chars
+        chunks.append(text[start:end])
+
+        # Avancer en tenant compte de l'overlap
+        start = end - overlap
+
+        # Éviter de créer un dernier chunk trop petit
+        if start >= len(text):
+            break
+    return chunks
+
 def extract_text_from_content(content):
     """
     Extrait tout le texte d'une structure content complexe
@@ -53,55 +173,45 @@ def extract_text_from_content(content):
     result = ' '.join(filter(None, texts))
     return result.strip()
 
-def embed_query(query):
-    from langchain_mistralai import MistralAIEmbeddings
-
-    embeddings = MistralAIEmbeddings(model="mistral-embed", api_key=os.getenv('MISTRAL_API_KEY'))
-
-    # Extraire le texte si c'est une structure complexe
+def query_to_text(query):
+    """
+    Extrait le texte si c'est une structure complexe
+    """
     if isinstance(query, (dict, list)):
         query = extract_text_from_content(query)
-    
+    return query if isinstance(query, str) else None
+
+def embed_query(query):
+    query = query_to_text(query)
+
     # S'assurer qu'on a du texte
-    if not query or not isinstance(query, str):
+    if not query:
         return []
-    
-    max_chars = 20000
-    overlap = 1000
 
-    # Si le texte est court, traitement normal
-    if len(query) <= max_chars:
-        response = embeddings.embed_query(query)
-        return response
-    
-    # Sinon, découper en chunks
-    chunks = []
-    start = 0
-    while start < len(query):
-        end = start + max_chars
-        chunks.append(query[start:end])
-        
-        # Avancer en tenant compte de l'overlap
-        start = end - overlap
-        
-        # Éviter de créer un dernier chunk trop petit
-        if start >= len(query):
-            break
+    chunks = split_text(query)
+    if len(chunks) > 1:
+        print(f"Document découpé en {len(chunks)} chunks")
+
+    # Tous les chunks partent dans la même requête
+    all_embeddings = embed_texts(chunks)
+    if len(all_embeddings) == 1:
+        return all_embeddings[0]
 
-    print(f"Document découpé en {len(chunks)} chunks")
-    
-    # Obtenir les embeddings de chaque chunk
-    all_embeddings = []
-    for chunk in chunks:
-        response = embeddings.embed_query(chunk)
-        all_embeddings.append(response)
-    
     # Moyenner les embeddings
-    import numpy as np
     avg_embedding = np.mean(all_embeddings, axis=0).tolist()
-    
+
     return avg_embedding
 
+async def aembed_query(query):
+    query = query_to_text(query)
+    if not query:
+        return []
+
+    all_embeddings = await aembed_texts(split_text(query))
+    if len(all_embeddings) == 1:
+        return all_embeddings[0]
+    return np.mean(all_embeddings, axis=0).tolist()
+
 def cosine_similarity(vec1, vec2):
     dot_product = np.dot(vec1, vec2)
     norm_vec1 = np.linalg.norm(vec1)
@@ -115,19 +225,118 @@ def euclidian(vec1, vec2):
     return np.sqrt(np.sum((np.array(vec1) - np.array(vec2))**2))
 
 
-def select_top_n_similar_documents(query, documents, n=3,metric='cosine'):
+class VectorIndex():
+    """
+    Index vectoriel : tous les embeddings dans une matrice float32 contiguë,
+    normes précalculées, un seul produit matrice-vecteur par requête
+    """
+    METRICS = ('cosine', 'manathan', 'euclidian')
+
+    def __init__(self, documents, matrix=None):
+        # Les documents sont conservés sans leur embedding (déjà dans la matrice)
+        if matrix is None:
+            matrix = np.array([doc["embedding"] for doc in documents], dtype=np.float32)
+            documents = [{k: v for k, v in doc.items() if k != "embedding"} for doc in documents]
+        self.documents = documents
+        self.matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        self.norms = np.linalg.norm(self.matrix, axis=1)
+        self.sq_norms = self.norms ** 2
+
+    def __len__(self):
+        return len(self.documents)
+
+    def scores(self, query_embedding, metric='cosine'):
+        """
+        Retourne un score par document, plus grand = plus proche
+        """
+        q = np.asarray(query_embedding, dtype=np.float32)
+        if metric == 'cosine':
+            q_norm = np.linalg.norm(q)
+            return (self.matrix @ q) / (self.norms * q_norm + 1e-12)
+        elif metric == 'euclidian':
+            # ||d - q||² = ||d||² - 2 d.q + ||q||²  (||q||² constant, inutile pour le classement)
+            return -(self.sq_norms - 2 * (self.matrix @ q))
+        elif metric == 'manathan':
+            # Pas de forme matricielle pour L1 : une seule passe vectorisée sur la matrice
+            return -np.abs(self.matrix - q).sum(axis=1)
+        raise ValueError("Unsupported metric. Choose from 'cosine', 'manathan', or 'euclidian'.")
+
+    def search(self, query_embedding, n=3, metric='cosine'):
+        """
+        Retourne les indices des n documents les plus proches, du plus proche au moins proche
+        """
+        scores = self.scores(query_embedding, metric)
+        n = min(n, len(scores))
+        if n <= 0:
+            return np.empty(0, dtype=np.int64)
+        if n < len(scores):
+            top = np.argpartition(-scores, n - 1)[:n]
+        else:
+            top = np.arange(len(scores))
+        return top[np.argsort(-scores[top], kind='stable')]
+
+    def search_grouped(self, query_embedding, n=3, metric='cosine', group_by='url'):
+        """
+        Comme search, mais ne garde que le meilleur chunk de chaque groupe (ex : une page)
+        """
+        scores = self.scores(query_embedding, metric)
+        # On ne trie qu'un sous-ensemble de candidats, élargi si trop peu de groupes distincts
+        candidates = min(len(scores), max(n * 8, 32))
+        while True:
+            if candidates < len(scores):
+                top = np.argpartition(-scores, candidates - 1)[:candidates]
+            else:
+                top = np.arange(len(scores))
+            top = top[np.argsort(-scores[top], kind='stable')]
+
+            selected, groups = [], set()
+            for i in top:
+                group = self.documents[i].get(group_by)
+                if group in groups:
+                    continue
+                groups.add(group)
+                selected.append(i)
+                if len(selected) == n:
+                    break
+            if len(selected) == n or candidates >= len(scores):
+                return np.array(selected, dtype=np.int64)
+            candidates = min(len(scores), candidates * 4)
+
+    def top_n(self, query_embedding, n=3, metric='cosine', group_by=None):
+        if group_by is not None:
+            return [self.documents[i] for i in self.search_grouped(query_embedding, n, metric, group_by)]
+        return [self.documents[i] for i in self.search(query_embedding, n, metric)]
+
+
+def build_rag_context(documents, max_tokens=None, separator=", "):
+    """
+    Assemble le contexte RAG à partir du texte précalculé des documents (simple lecture),
+    en s'arrêtant au budget de tokens s'il est fourni
+    """
+    texts, total = [], 0
+    for doc in documents:
+        n_tokens = doc.get('n_tokens') or estimate_tokens(doc['texte'])
+        if max_tokens is not None and texts and total + n_tokens > max_tokens:
+            break
+        texts.append(doc['texte'])
+        total += n_tokens
+    return separator.join(texts)
+
+
+def select_top_n_similar_documents(query, documents, n=3,metric='cosine', group_by=None):
     #metric can be 'cosine', 'manathan', 'euclidian'
+    #documents can be a list of documents with "embedding" or a VectorIndex
+    #group_by (ex : 'url') keeps only the best chunk of each page
+    if metric not in VectorIndex.METRICS:
+        raise ValueError("Unsupported metric. Choose from 'cosine', 'manathan', or 'euclidian'.")
+    index = documents if isinstance(documents, VectorIndex) else VectorIndex(documents)
     query_embedding = embed_query(query)
-    if metric == 'cosine':
-        similarities = [cosine_similarity(query_embedding, doc["embedding"]) for doc in documents]
-        top_n_indices = np.argsort(similarities)[-n:]
-    elif metric == 'manathan':
-        distances = [manathan(query_embedding, doc["embedding"]) for doc in documents]
-        top_n_indices = np.argsort(distances)[:n]
-    elif metric == 'euclidian':
-        distances = [euclidian(query_embedding, doc["embedding"]) for doc in documents]
-        top_n_indices = np.argsort(distances)[:n]
-    else:
+    return index.top_n(query_embedding, n=n, metric=metric, group_by=group_by)
+
+
+async def aselect_top_n_similar_documents(query, documents, n=3, metric='cosine', group_by=None):
+    if metric not in VectorIndex.METRICS:
         raise ValueError("Unsupported metric. Choose from 'cosine', 'manathan', or 'euclidian'.")
-    top_n_documents = [documents[i] for i in top_n_indices]
-    return top_n_documents
+    index = documents if isinstance(documents, VectorIndex) else VectorIndex(documents)
+    query_embedding = await aembed_query(query)
+    return index.top_n(query_embedding, n=n, metric=metric, group_by=group_by)
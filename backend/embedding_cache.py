@@ -0,0 +1,74 @@
+"""
+Cache persistant des embeddings, adressé par contenu : clé = (modèle, sha256 du texte normalisé)
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import unicodedata
+import numpy as np
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(__file__), 'data', 'embedding_cache.sqlite')
+
+
+def normalize_text(text):
+    """
+    Normalise un texte avant hachage (unicode NFC, espaces compactés)
+    """
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+
+def text_hash(text):
+    return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache():
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL, hash TEXT NOT NULL, vector BLOB NOT NULL,"
+            " PRIMARY KEY (model, hash))"
+        )
+        self._conn.commit()
+
+    def get_many(self, model, texts):
+        """
+        Retourne une liste alignée sur texts : l'embedding en cache ou None
+        """
+        hashes = [text_hash(t) for t in texts]
+        found = {}
+        with self._lock:
+            # Requêtes par paquets pour rester sous la limite de variables SQLite
+            unique = list(dict.fromkeys(hashes))
+            for start in range(0, len(unique), 500):
+                batch = unique[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({','.join('?' * len(batch))})",
+                    [model, *batch],
+                ).fetchall()
+                found.update(rows)
+        return [np.frombuffer(found[h], dtype=np.float32).tolist() if h in found else None for h in hashes]
+
+    def get(self, model, text):
+        return self.get_many(model, [text])[0]
+
+    def put_many(self, model, texts, embeddings):
+        rows = [
+            (model, text_hash(t), np.asarray(e, dtype=np.float32).tobytes())
+            for t, e in zip(texts, embeddings)
+        ]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+
+    def put(self, model, text, embedding):
+        self.put_many(model, [text], [embedding])
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
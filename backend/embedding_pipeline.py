@@ -0,0 +1,185 @@
+"""
+Pipeline d'embedding asynchrone pour l'ingestion : pool de workers à concurrence bornée,
+limitation de débit (token bucket), backoff exponentiel avec jitter et reprise sur le cache
+"""
+import asyncio
+import os
+import random
+import time
+import httpx
+
+from embedding import EMBEDDING_MODEL, estimate_tokens, make_batches, get_embedding_cache
+
+MISTRAL_API_URL = os.getenv('MISTRAL_API_URL', 'https://api.mistral.ai')
+EMBEDDING_CONCURRENCY = int(os.getenv('EMBEDDING_CONCURRENCY', 4))
+EMBEDDING_RPS = float(os.getenv('EMBEDDING_RPS', 5))
+EMBEDDING_TPM = float(os.getenv('EMBEDDING_TPM', 0)) or None
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class TokenBucket():
+    """
+    Token bucket : `rate` jetons par seconde, au plus `capacity` jetons en réserve
+    """
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self, tokens=1):
+        # Une demande plus grosse que la réserve attend que la réserve soit pleine
+        tokens = min(tokens, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+
+class EmbeddingRequestError(Exception):
+    def __init__(self, message, status_code=None, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class AsyncEmbeddingPipeline():
+    def __init__(self, model=EMBEDDING_MODEL, api_key=None, base_url=MISTRAL_API_URL,
+                 concurrency=EMBEDDING_CONCURRENCY, requests_per_second=EMBEDDING_RPS,
+                 tokens_per_minute=EMBEDDING_TPM, max_retries=6, base_delay=1.0, max_delay=60.0,
+                 timeout=60.0, cache=None, transport=None):
+        self.model = model
+        self.api_key = api_key or os.getenv('MISTRAL_API_KEY')
+        self.base_url = base_url.rstrip('/')
+        self.concurrency = concurrency
+        self.requests_per_second = requests_per_second
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.cache = cache if cache is not None else get_embedding_cache()
+        # transport injectable pour tester hors-ligne (httpx.MockTransport, serveur local...)
+        self.transport = transport
+        self.stats = {"requests": 0, "retries": 0, "cached": 0, "embedded": 0}
+
+    def backoff_delay(self, attempt, retry_after=None):
+        """
+        Backoff exponentiel avec full jitter, borné par max_delay ; Retry-After est respecté
+        """
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    async def _post(self, client, texts):
+        response = await client.post(
+            f"{self.base_url}/v1/embeddings",
+            json={"model": self.model, "input": texts},
+        )
+        if response.status_code != 200:
+            retry_after = response.headers.get('retry-after')
+            try:
+                retry_after = float(retry_after) if retry_after is not None else None
+            except ValueError:
+                retry_after = None
+            raise EmbeddingRequestError(
+                f"Erreur API embedding {response.status_code} : {response.text[:200]}",
+                status_code=response.status_code, retry_after=retry_after,
+            )
+        data = sorted(response.json()["data"], key=lambda d: d["index"])
+        return [d["embedding"] for d in data]
+
+    async def _embed_batch(self, client, texts, request_bucket, token_bucket):
+        attempt = 0
+        while True:
+            if request_bucket is not None:
+                await request_bucket.acquire()
+            if token_bucket is not None:
+                await token_bucket.acquire(sum(estimate_tokens(t) for t in texts))
+            self.stats["requests"] += 1
+            try:
+                return await self._post(client, texts)
+            except (httpx.TimeoutException, httpx.TransportError, EmbeddingRequestError) as e:
+                status_code = getattr(e, 'status_code', None)
+                if status_code is not None and status_code not in RETRYABLE_STATUS:
+                    raise
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff_delay(attempt, getattr(e, 'retry_after', None))
+                print(f"  Nouvel essai dans {delay:.1f}s ({e.__class__.__name__} {status_code or ''})")
+                self.stats["retries"] += 1
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    async def embed(self, texts):
+        """
+        Embedding d'une liste de textes. Les résultats déjà en cache sont repris,
+        chaque lot réussi est enregistré immédiatement (reprise possible après un échec)
+        """
+        results = self.cache.get_many(self.model, texts) if self.cache is not None else [None] * len(texts)
+        missing = [i for i, r in enumerate(results) if r is None]
+        self.stats["cached"] += len(texts) - len(missing)
+        if not missing:
+            return results
+
+        missing_texts = [texts[i] for i in missing]
+        queue = asyncio.Queue()
+        for batch in make_batches(missing_texts):
+            queue.put_nowait(batch)
+        total_batches = queue.qsize()
+        print(f"Embedding de {len(missing_texts)} textes en {total_batches} requêtes "
+              f"({self.concurrency} en parallèle)")
+
+        request_bucket = TokenBucket(self.requests_per_second) if self.requests_per_second else None
+        token_bucket = TokenBucket(self.tokens_per_minute / 60, self.tokens_per_minute) if self.tokens_per_minute else None
+        errors = []
+        done = 0
+
+        async def worker(client):
+            nonlocal done
+            while True:
+                try:
+                    batch = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                batch_texts = [missing_texts[j] for j in batch]
+                try:
+                    embeddings = await self._embed_batch(client, batch_texts, request_bucket, token_bucket)
+                except Exception as e:
+                    # Les autres lots continuent : ils seront repris depuis le cache au prochain lancement
+                    errors.append(e)
+                    continue
+                if self.cache is not None:
+                    self.cache.put_many(self.model, batch_texts, embeddings)
+                for j, embedding in zip(batch, embeddings):
+                    results[missing[j]] = embedding
+                self.stats["embedded"] += len(batch)
+                done += 1
+                if done % 10 == 0 or done == total_batches:
+                    print(f"  {done}/{total_batches} requêtes traitées")
+
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        async with httpx.AsyncClient(headers=headers, timeout=self.timeout, transport=self.transport) as client:
+            await asyncio.gather(*(worker(client) for _ in range(self.concurrency)))
+
+        if errors:
+            raise errors[0]
+        return results
+
+
+def embed_texts_async(texts, **kwargs):
+    """
+    Point d'entrée synchrone pour les scripts d'ingestion
+    """
+    return asyncio.run(AsyncEmbeddingPipeline(**kwargs).embed(texts))
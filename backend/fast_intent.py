@@ -0,0 +1,318 @@
+"""
+Pré-classification de l'intention sans LLM, avant IntentAgent
+
+Des règles (mots-clés / regex) décident les cas évidents : politesses, réponse courte
+pendant la collecte des infos d'itinéraire ("10h", "demain", "en famille"...), demande de visite
+explicite, question sur un lieu du château. En option, un modèle au plus proche centroïde
+(embeddings d'exemples, fichier FAST_INTENT_CENTROIDS) complète les règles.
+Si aucune décision n'atteint le seuil de confiance, IntentAgent appelle le LLM comme avant
+
+Les mêmes règles servent de détecteur de changement de sujet pour l'intention "collante" :
+pendant la collecte des infos d'itinéraire, le graphe saute IntentAgent tant que le message
+ne ressemble pas à une autre demande
+"""
+import os
+import re
+import sys
+from collections import Counter
+import numpy as np
+
+from embedding import aembed_query, embed_query, embed_texts
+
+FAST_INTENT_ENABLED = os.getenv('FAST_INTENT_ENABLED', '1').lower() in ('1', 'true', 'yes')
+# Confiance minimale pour se passer du LLM
+FAST_INTENT_THRESHOLD = float(os.getenv('FAST_INTENT_THRESHOLD', 0.9))
+FAST_INTENT_CENTROIDS = os.getenv('FAST_INTENT_CENTROIDS', os.path.join(os.path.dirname(__file__), 'data', 'intent_centroids.npz'))
+# Centroïdes : similarité cosinus minimale et écart minimal avec le deuxième centroïde
+FAST_INTENT_MIN_SIMILARITY = float(os.getenv('FAST_INTENT_MIN_SIMILARITY', 0.8))
+FAST_INTENT_MIN_MARGIN = float(os.getenv('FAST_INTENT_MIN_MARGIN', 0.05))
+# Au-delà, le message est trop long pour être décidé par une règle
+FAST_INTENT_MAX_CHARS = int(os.getenv('FAST_INTENT_MAX_CHARS', 120))
+
+# Intention collante : pendant la collecte des infos d'itinéraire, IntentAgent est sauté
+STICKY_INTENT = os.getenv('STICKY_INTENT', '1').lower() in ('1', 'true', 'yes')
+
+# Intentions = champs de IntentOutput
+ROAD = "user_wants_road_in_versailles"
+SPECIFIC = "user_wants_specific_info"
+OFF_TOPIC = "user_asks_off_topic"
+INTENTS = (ROAD, SPECIFIC, OFF_TOPIC)
+
+ACKNOWLEDGEMENT_WORDS = r"ok|okay|d'accord|parfait|super|génial|genial|cool|top"
+COURTESY_SUFFIX = r"( (à vous|a vous|à toi|a toi|beaucoup|!))*[\s!.,😊🙂]*$"
+COURTESY = re.compile(
+    r"^(bonjour|bonsoir|salut|coucou|hello|hi|hey|merci( beaucoup| bien)?|thanks?( you)?( very much)?|thx"
+    r"|au revoir|bye|goodbye|see you|à bientôt|a bientot|bonne (journée|soirée|journee|soiree)"
+    r"|have a (nice|good) day|" + ACKNOWLEDGEMENT_WORDS + ")" + COURTESY_SUFFIX,
+    re.IGNORECASE,
+)
+# "ok", "d'accord"... : pendant la collecte des infos d'itinéraire, un simple accusé de réception
+ACKNOWLEDGEMENT = re.compile(r"^(" + ACKNOWLEDGEMENT_WORDS + ")" + COURTESY_SUFFIX, re.IGNORECASE)
+
+# Réponses typiques à une question de l'agent d'itinéraire (date, heure, groupe, durée, budget)
+SLOT_PREFIX = r"(le |la |à |a |vers |pour |en |avec |on est |nous sommes |we are |at |on |in |around )?"
+SLOT_ITEM = (
+    r"("
+    r"\d{1,2}\s*(h|heures?|:)\s*\d{0,2}|\d{1,2}\s*(am|pm)"
+    r"|\d{1,2}[/.-]\d{1,2}([/.-]\d{2,4})?|\d{4}-\d{2}-\d{2}"
+    r"|\d{1,2}(er)? (janvier|février|fevrier|mars|avril|mai|juin|juillet|août|aout|septembre|octobre|novembre|décembre|decembre)( \d{4})?"
+    r"|(january|february|march|april|may|june|july|august|september|october|november|december) \d{1,2}(st|nd|rd|th)?"
+    r"|aujourd'hui|demain|après-demain|apres-demain|today|tomorrow|ce week-end|this weekend"
+    r"|(lundi|mardi|mercredi|jeudi|vendredi|samedi|dimanche|monday|tuesday|wednesday|thursday|friday|saturday|sunday)( prochain| next)?"
+    r"|matin|après-midi|apres-midi|morning|afternoon"
+    r"|\d+([.,]\d+)?\s*(€|euros?|eur)|budget \w+|(petit|gros|moyen) budget|économique|economique|cheap|gratuit|free"
+    # Durées ("3h", "3 heures" sont déjà couverts par l'alternative des heures)
+    r"|\d+[.,]\d+\s*(h|heures?|hours?)|\d+\s*hours?|(une |la |a |half a |a full )?(demi-)?(journée|journee|day)( entière| complète)?"
+    r"|seule?|solo|alone|en couple|couple|(en |with )?(famille|family)|(entre |with )?(amis|friends)"
+    r"|(avec )?(des |mes |nos )?enfants|with (my |our )?kids|(en )?groupe|scolaire|school"
+    r"|oui|non|yes|no"
+    r")"
+)
+# Une ou plusieurs réponses : "10h", "demain vers 10h", "samedi, en famille, 50 €"
+SLOT_ANSWER = re.compile(
+    rf"^\s*{SLOT_PREFIX}{SLOT_ITEM}([\s,]+(et |and |puis )?{SLOT_PREFIX}{SLOT_ITEM})*[\s!.,]*$",
+    re.IGNORECASE,
+)
+
+VISIT_REQUEST = re.compile(
+    r"(je (veux|voudrais|souhaite|souhaiterais|compte|vais)|j'aimerais|nous (voulons|voudrions|souhaitons)|on (veut|voudrait)"
+    r"|i (want|would like|'d like|plan)|we (want|would like|'d like|plan)|can you|pouvez-vous|peux-tu)"
+    r".{0,40}(visiter|visite|visit|itinéraire|itineraire|itinerary|parcours|programme|plan)",
+    re.IGNORECASE,
+)
+
+# Mentions qui désignent Versailles (et pas un autre château)
+VERSAILLES = re.compile(
+    r"(versailles|trianon|galerie des glaces|hall of mirrors|hameau de la reine|queen's hamlet|marie-antoinette"
+    r"|(le|du|au) ch[aâ]teau(?! d[eu'])|the (castle|palace)(?! of))",
+    re.IGNORECASE,
+)
+
+LANDMARK = re.compile(
+    r"(galerie des glaces|hall of mirrors|grand trianon|petit trianon|trianon|hameau de la reine|queen's hamlet"
+    r"|chapelle royale|royal chapel|opéra royal|opera royal|royal opera|grandes eaux|jardins?|gardens?"
+    r"|bosquets?|groves?|fontaines?|fountains?|grand canal|appartements? (du roi|de la reine)|king's apartments?"
+    r"|queen's apartments?|chambre du roi|orangerie|domaine de marie-antoinette|marie-antoinette|louis xiv)",
+    re.IGNORECASE,
+)
+
+QUESTION = re.compile(
+    r"(\?|^(qui|quand|quel|quelle|quels|quelles|combien|comment|pourquoi|où|ou est|est-ce|c'est quoi|what|who|when|where|how|why|is|are|can)\b)",
+    re.IGNORECASE,
+)
+
+# Exemples pour construire les centroïdes (python fast_intent.py)
+EXAMPLES = {
+    ROAD: [
+        "Je veux visiter le château de Versailles",
+        "Je voudrais organiser une visite à Versailles",
+        "Pouvez-vous me préparer un itinéraire pour le château ?",
+        "I want to visit Versailles",
+        "How can I plan a trip to the castle?",
+        "Nous venons en famille samedi, que faire au château ?",
+    ],
+    SPECIFIC: [
+        "Parle-moi de la galerie des Glaces",
+        "Quels sont les horaires d'ouverture des jardins ?",
+        "Qui a conçu les fontaines des jardins ?",
+        "Tell me about the Hall of Mirrors",
+        "What are the opening hours of the gardens?",
+        "Who designed the fountains in the gardens?",
+    ],
+    OFF_TOPIC: [
+        "Bonjour",
+        "Merci beaucoup",
+        "Je veux visiter la tour de Pise",
+        "Donne-moi une recette de pâtes",
+        "I want to visit the Tower of Pisa",
+        "Tell me about cooking pasta",
+    ],
+}
+
+
+def intent_output(intent):
+    """
+    Même format que IntentAgent.format_intent : un seul champ à True
+    """
+    return {name: name == intent for name in INTENTS}
+
+
+def slot_filling_in_progress(state):
+    """
+    L'agent d'itinéraire attend une réponse : infos incomplètes, et intention "visite"
+    au tour précédent ou infos déjà en partie remplies
+    """
+    values = list(state.necessary_info_for_road.values())
+    if all(value is not None for value in values):
+        return False
+    # Infos déjà en partie remplies : la collecte reprend même après une question annexe
+    return bool(state.user_wants_road_in_versailles) or any(value is not None for value in values)
+
+
+def last_user_text(state):
+    if not state.messages or state.messages[-1].type != "human":
+        return None
+    content = state.messages[-1].content
+    return content.strip() if isinstance(content, str) else None
+
+
+class FastIntentClassifier():
+    def __init__(self, threshold=FAST_INTENT_THRESHOLD, centroids_path=FAST_INTENT_CENTROIDS,
+                 min_similarity=FAST_INTENT_MIN_SIMILARITY, min_margin=FAST_INTENT_MIN_MARGIN):
+        self.threshold = threshold
+        self.min_similarity = min_similarity
+        self.min_margin = min_margin
+        self.labels, self.centroids = None, None
+        if centroids_path and os.path.exists(centroids_path):
+            data = np.load(centroids_path)
+            self.labels = [str(label) for label in data["labels"]]
+            self.centroids = data["centroids"].astype(np.float32)
+        self.stats = {"calls": 0, "rules": 0, "centroids": 0, "llm": 0, "sticky": 0, "drift": 0}
+        self.rule_hits = Counter()
+
+    def classify_rules(self, text, state):
+        """
+        (intention, confiance, règle) ou None
+        """
+        if len(text) > FAST_INTENT_MAX_CHARS:
+            return None
+        slot_filling = slot_filling_in_progress(state)
+        if slot_filling and ACKNOWLEDGEMENT.match(text):
+            # La conversation reste sur l'itinéraire : l'agent repose la question en attente
+            return ROAD, 0.95, "acknowledgement"
+        if COURTESY.match(text):
+            # Politesses : l'agent hors sujet y répond poliment
+            return OFF_TOPIC, 0.97, "courtesy"
+        if slot_filling and SLOT_ANSWER.match(text):
+            return ROAD, 0.95, "slot_answer"
+        landmark, question = LANDMARK.search(text), QUESTION.search(text)
+        if VISIT_REQUEST.search(text):
+            if landmark and question:
+                # "Je veux visiter les jardins, quels sont les horaires ?" : ambigu
+                return None
+            if VERSAILLES.search(text):
+                return ROAD, 0.92, "visit_request"
+            # "Je veux visiter la tour de Pise" : à confirmer par le LLM
+            return ROAD, 0.6, "visit_request"
+        if landmark and question:
+            return SPECIFIC, 0.9, "landmark_question"
+        return None
+
+    def classify_centroids(self, embedding):
+        """
+        (intention, confiance) du centroïde le plus proche, ou None si trop incertain
+        """
+        q = np.asarray(embedding, dtype=np.float32)
+        similarities = self.centroids @ q / (np.linalg.norm(q) + 1e-12)
+        order = np.argsort(similarities)[::-1]
+        best, second = similarities[order[0]], similarities[order[1]] if len(order) > 1 else -1.0
+        if best < self.min_similarity or best - second < self.min_margin:
+            return None
+        return self.labels[order[0]], float(best)
+
+    def _decide_rules(self, state):
+        self.stats["calls"] += 1
+        text = last_user_text(state)
+        if text is None:
+            return None, None
+        decision = self.classify_rules(text, state)
+        if decision is not None and decision[1] >= self.threshold:
+            intent, _, rule = decision
+            self.stats["rules"] += 1
+            self.rule_hits[rule] += 1
+            return intent_output(intent), text
+        return None, text
+
+    def _decide_centroids(self, embedding):
+        decision = self.classify_centroids(embedding)
+        if decision is not None:
+            self.stats["centroids"] += 1
+            self.rule_hits[f"centroid:{decision[0]}"] += 1
+            return intent_output(decision[0])
+        self.stats["llm"] += 1
+        return None
+
+    def classify(self, state):
+        """
+        Intention au format IntentAgent.format_intent, ou None : IntentAgent appelle alors le LLM
+        """
+        output, text = self._decide_rules(state)
+        if output is not None:
+            return output
+        if text is None or self.centroids is None or len(text) > FAST_INTENT_MAX_CHARS:
+            self.stats["llm"] += 1
+            return None
+        return self._decide_centroids(embed_query(text))
+
+    async def aclassify(self, state):
+        output, text = self._decide_rules(state)
+        if output is not None:
+            return output
+        if text is None or self.centroids is None or len(text) > FAST_INTENT_MAX_CHARS:
+            self.stats["llm"] += 1
+            return None
+        return self._decide_centroids(await aembed_query(text))
+
+    def detects_drift(self, state):
+        """
+        Pendant la collecte des infos d'itinéraire : True si le message semble changer de sujet
+        (politesse, question sur un lieu, autre question), et l'intention doit être réévaluée
+        """
+        text = last_user_text(state)
+        if text is None:
+            drift = True
+        elif len(text) <= FAST_INTENT_MAX_CHARS and SLOT_ANSWER.match(text):
+            drift = False
+        else:
+            decision = self.classify_rules(text, state)
+            if decision is not None:
+                drift = decision[0] != ROAD or decision[1] < self.threshold
+            else:
+                # Une question que les règles ne savent pas classer : le LLM tranche
+                drift = bool(QUESTION.search(text))
+        self.stats["drift" if drift else "sticky"] += 1
+        return drift
+
+    def info(self):
+        calls = self.stats["calls"]
+        fast = self.stats["rules"] + self.stats["centroids"]
+        return {
+            **self.stats,
+            "hit_rate": fast / calls if calls else 0.0,
+            "threshold": self.threshold,
+            "centroids_loaded": self.centroids is not None,
+            "hits": dict(self.rule_hits),
+        }
+
+
+def build_centroids(examples=EXAMPLES, path=FAST_INTENT_CENTROIDS):
+    """
+    Calcule un centroïde normalisé par intention à partir des exemples (embeddings mis en cache)
+    """
+    labels = list(examples)
+    centroids = []
+    for label in labels:
+        vectors = np.asarray(embed_texts(examples[label]), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12
+        centroid = vectors.mean(axis=0)
+        centroids.append(centroid / (np.linalg.norm(centroid) + 1e-12))
+    np.savez(path, labels=np.array(labels), centroids=np.array(centroids, dtype=np.float32))
+    print(f"✅ {len(labels)} centroïdes d'intention enregistrés dans {path}")
+    return path
+
+
+fast_intent_classifier = None
+
+def get_fast_intent_classifier():
+    """
+    Classifieur partagé par tout le processus (None si FAST_INTENT_ENABLED est faux)
+    """
+    global fast_intent_classifier
+    if fast_intent_classifier is None:
+        fast_intent_classifier = FastIntentClassifier() if FAST_INTENT_ENABLED else False
+    return fast_intent_classifier if fast_intent_classifier is not False else None
+
+
+# Utilisation : python fast_intent.py [fichier .npz]
+if __name__ == "__main__":
+    build_centroids(path=sys.argv[1] if len(sys.argv) > 1 else FAST_INTENT_CENTROIDS)
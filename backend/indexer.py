@@ -0,0 +1,140 @@
+"""
+Ré-indexation incrémentale : compare un nouveau crawl au store existant (URL + hash du contenu),
+ne ré-embedde que les pages nouvelles ou modifiées, supprime les pages disparues
+et réécrit le store de façon atomique
+
+Le store contient un vecteur par chunk (et non un vecteur moyen par page) ; chaque chunk
+garde l'URL de sa page et son chemin de titres
+"""
+import hashlib
+import json
+import os
+import sys
+import numpy as np
+
+from chunking import iter_chunks
+from create_db import iter_documents
+from embedding_pipeline import embed_texts_async
+from store import load_store, save_store, store_prefix
+
+SEMANTIC_STORE = os.path.join(os.path.dirname(__file__), 'data', 'semantic_embedded')
+# Nombre de chunks accumulés avant d'envoyer une vague au pipeline d'embedding
+EMBED_WINDOW = int(os.getenv('INDEX_EMBED_WINDOW', 512))
+
+
+def document_key(document):
+    """
+    Identifiant stable d'un document : l'URL pour les pages, l'id pour les conseils
+    """
+    return document.get('url') or document.get('id')
+
+
+def content_hash(document):
+    """
+    Hash du contenu indexé (hors métadonnées de crawl comme parsed_at)
+    """
+    payload = {k: document.get(k) for k in ('title', 'content', 'texte')}
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def page_chunks(document):
+    """
+    Découpe une page en chunks alignés sur ses sections.
+    Génère des paires (métadonnées du chunk, texte à embedder)
+    """
+    content = document.get("content", []) if "content" in document else document.get("texte", "")
+    for i, chunk in enumerate(iter_chunks(content)):
+        record = {
+            "url": document_key(document),
+            "title": document.get("title", document.get("id", "")),
+            "chunk_index": i,
+            "heading_path": chunk["heading_path"],
+            "content_hash": document["content_hash"],
+            "parsed_at": document.get("parsed_at"),
+            "texte": chunk["text"],
+        }
+        breadcrumb = ' > '.join(chunk["heading_path"])
+        yield record, f"URL: {record['url']}\nTitre: {record['title']}\nSection: {breadcrumb}\n\n{chunk['text']}"
+
+
+def update_index(crawl_file, prefix=SEMANTIC_STORE):
+    """
+    Met à jour le store `prefix` à partir du fichier de crawl, et retourne les statistiques
+    """
+    prefix = store_prefix(prefix)
+    try:
+        old_metadata, old_matrix = load_store(prefix)
+    except FileNotFoundError:
+        old_metadata, old_matrix = [], None
+
+    # Lignes existantes regroupées par page
+    old_pages = {}
+    for row, record in enumerate(old_metadata):
+        page = old_pages.setdefault(document_key(record), {"hash": record.get("content_hash"), "rows": []})
+        page["rows"].append(row)
+
+    records, reused_rows, pending, new_vectors = [], [], [], {}
+    seen = set()
+    stats = {"unchanged": 0, "new": 0, "modified": 0, "deleted": 0, "empty": 0}
+
+    def embed_pending():
+        # Les documents sont lus en flux : seuls les textes de la vague en cours sont gardés en mémoire
+        embeddings = embed_texts_async([text for _, text in pending])
+        for (position, _), embedding in zip(pending, embeddings):
+            new_vectors[position] = np.asarray(embedding, dtype=np.float32)
+        pending.clear()
+
+    for document in iter_documents(crawl_file):
+        key = document_key(document)
+        if key in seen:
+            continue
+        seen.add(key)
+        document["content_hash"] = content_hash(document)
+
+        old = old_pages.get(key)
+        if old is not None and old["hash"] == document["content_hash"]:
+            stats["unchanged"] += 1
+            for row in old["rows"]:
+                records.append(old_metadata[row])
+                reused_rows.append(row)
+            continue
+
+        first_position = len(records)
+        for record, text in page_chunks(document):
+            pending.append((len(records), text))
+            records.append(record)
+            reused_rows.append(None)
+        if len(records) == first_position:
+            # Page sans texte : rien à indexer
+            stats["empty"] += 1
+        else:
+            stats["modified" if old is not None else "new"] += 1
+        if len(pending) >= EMBED_WINDOW:
+            embed_pending()
+    if pending:
+        embed_pending()
+    stats["deleted"] = len(set(old_pages) - seen)
+    print(f"Index {prefix} : {stats}")
+
+    if not new_vectors and not stats["deleted"] and len(records) == len(old_metadata):
+        print("✅ Index déjà à jour")
+        return stats
+
+    dim = old_matrix.shape[1] if old_matrix is not None else len(next(iter(new_vectors.values())))
+    matrix = np.empty((len(records), dim), dtype=np.float32)
+    for position, row in enumerate(reused_rows):
+        if row is not None:
+            matrix[position] = old_matrix[row]
+        else:
+            matrix[position] = new_vectors[position]
+
+    matrix_path, meta_path = save_store(records, prefix, matrix=matrix)
+    print(f"✅ {len(seen)} pages ({len(records)} chunks) indexées dans {matrix_path} et {meta_path}")
+    return stats
+
+
+# Utilisation : python indexer.py [crawl.jsonl] [préfixe du store]
+if __name__ == "__main__":
+    crawl_file = sys.argv[1] if len(sys.argv) > 1 else "data/versailles_semantic_complete_20250813_204248.jsonl"
+    prefix = sys.argv[2] if len(sys.argv) > 2 else SEMANTIC_STORE
+    update_index(crawl_file, prefix)
@@ -0,0 +1,304 @@
+"""
+Persistance des conversations dans SQLite, en écriture différée (write-behind)
+
+Le tour de conversation ne fait que déposer le State sérialisé dans une file ; un thread
+d'écriture regroupe les sessions modifiées et les enregistre en une seule transaction.
+Les sessions survivent ainsi à un redémarrage et peuvent être relues par un autre worker
+
+En mode partagé (plusieurs workers), chaque sauvegarde est écrite immédiatement avec un
+numéro de version : un worker qui a la session en mémoire vérifie la version avant de s'en servir.
+Un tour prend un bail (lease) sur sa session pour que deux workers ne la traitent pas en même
+temps, et la sauvegarde échoue (SessionConflict) si la version a changé depuis la lecture
+"""
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+
+from langchain_core.messages import messages_from_dict, messages_to_dict
+
+from setup_graph import State
+
+DEFAULT_SESSION_DB = os.path.join(os.path.dirname(__file__), 'data', 'sessions.sqlite')
+# Délai maximal avant qu'une session modifiée soit écrite sur disque
+SESSION_FLUSH_INTERVAL = float(os.getenv('SESSION_FLUSH_INTERVAL', 0.5))
+SESSION_FLUSH_BATCH = int(os.getenv('SESSION_FLUSH_BATCH', 100))
+# Les sessions inactives depuis plus longtemps sont supprimées de la base au démarrage
+SESSION_DB_TTL = float(os.getenv('SESSION_DB_TTL', 7 * 24 * 3600))
+# Mode partagé : activé par défaut dès que uvicorn lance plusieurs workers
+SESSION_SHARED = os.getenv('SESSION_SHARED', str(int(os.getenv('WEB_CONCURRENCY', 1)) > 1)).lower() in ('1', 'true', 'yes')
+# Durée d'un bail de session : un worker arrêté en plein tour ne bloque pas la session au-delà
+SESSION_LEASE_TTL = float(os.getenv('SESSION_LEASE_TTL', 300))
+
+# save() sans vérification de version
+NO_CHECK = object()
+
+
+class SessionConflict(Exception):
+    """La session a été modifiée par un autre worker depuis sa lecture"""
+
+
+def dump_state(state):
+    """
+    Sérialise un State : JSON compact (messages via messages_to_dict) compressé avec zlib
+    """
+    # Le résultat spéculatif et le contexte RAG préchargé ne vivent que pendant un tour
+    payload = state.model_dump(exclude={"messages", "speculative", "rag_context"})
+    payload["messages"] = messages_to_dict(state.messages)
+    return zlib.compress(json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+
+def load_state(data):
+    payload = json.loads(zlib.decompress(data).decode('utf-8'))
+    payload["messages"] = messages_from_dict(payload["messages"])
+    return State(**payload)
+
+
+class SQLiteSessionBackend():
+    def __init__(self, path=DEFAULT_SESSION_DB, flush_interval=SESSION_FLUSH_INTERVAL,
+                 flush_batch=SESSION_FLUSH_BATCH, ttl=SESSION_DB_TTL, shared=SESSION_SHARED):
+        self.path = path
+        # shared : écriture immédiate (write-through) pour que les autres workers voient chaque tour
+        self.shared = shared
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.ttl = ttl
+        self.stats = {"writes": 0, "commits": 0, "loads": 0}
+        # Connexion et thread d'écriture créés au premier usage, et recréés dans un processus
+        # forké (workers uvicorn) : ni l'un ni l'autre ne survit à un fork
+        self._pid = None
+        self._conn = None
+        self._writer = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        # La connexion a son propre verrou : une transaction en cours ne bloque pas save()
+        self._db_lock = threading.Lock()
+        # session_id -> State sérialisé (None : suppression), en attente d'écriture
+        self._pending = {}
+        # Lot en cours d'écriture, encore visible pour load()
+        self._inflight = {}
+        self._closed = False
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("PRAGMA busy_timeout=5000")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " session_id TEXT PRIMARY KEY, state BLOB NOT NULL, updated_at REAL NOT NULL,"
+                " version TEXT NOT NULL DEFAULT '')"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS session_leases ("
+                " session_id TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(sessions)")]
+            if "version" not in columns:
+                # Base créée avant l'ajout des versions
+                self._conn.execute("ALTER TABLE sessions ADD COLUMN version TEXT NOT NULL DEFAULT ''")
+            if self.ttl:
+                self._conn.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl,))
+            self._conn.commit()
+            self._pending = {}
+            self._inflight = {}
+            self._closed = False
+            self._writer = threading.Thread(target=self._write_loop, name="session-writer", daemon=True)
+            self._writer.start()
+            self._pid = os.getpid()
+
+    def load_versioned(self, session_id):
+        """
+        (State, version) enregistrés pour la session, ou (None, None).
+        Une écriture encore en attente est prioritaire
+        """
+        self._ensure_started()
+        with self._lock:
+            for queued in (self._pending, self._inflight):
+                if session_id in queued:
+                    data, version = queued[session_id]
+                    return (load_state(data), version) if data is not None else (None, None)
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT state, version FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        self.stats["loads"] += 1
+        return (load_state(row[0]), row[1]) if row else (None, None)
+
+    def load(self, session_id):
+        return self.load_versioned(session_id)[0]
+
+    def version(self, session_id):
+        """
+        Version enregistrée de la session (None si elle n'existe pas) : lecture d'une seule colonne
+        """
+        self._ensure_started()
+        with self._lock:
+            for queued in (self._pending, self._inflight):
+                if session_id in queued:
+                    return queued[session_id][1]
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT version FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def save(self, session_id, state, expected_version=NO_CHECK):
+        """
+        Sérialise le State tout de suite (il peut être modifié ensuite) et diffère l'écriture,
+        sauf en mode partagé où elle est faite immédiatement. Retourne la nouvelle version.
+        En mode partagé, expected_version (None : session absente) est comparée à la version
+        enregistrée dans la même transaction ; SessionConflict si elle diffère
+        """
+        data = dump_state(state)
+        version = uuid.uuid4().hex
+        self._ensure_started()
+        if self.shared and expected_version is not NO_CHECK:
+            self._write_pending()
+            self._write_if_version(session_id, data, version, expected_version)
+            return version
+        with self._lock:
+            self._pending[session_id] = (data, version)
+            if len(self._pending) >= self.flush_batch:
+                self._wakeup.notify()
+        if self.shared:
+            self._write_pending()
+        return version
+
+    def delete(self, session_id):
+        self._ensure_started()
+        with self._lock:
+            self._pending[session_id] = (None, None)
+        if self.shared:
+            self._write_pending()
+
+    def _write_pending(self):
+        """
+        Écrit toutes les sessions en attente en une seule transaction
+        """
+        with self._db_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._inflight = batch
+            if not batch:
+                return
+            now = time.time()
+            upserts = [(sid, data, now, version) for sid, (data, version) in batch.items() if data is not None]
+            deletes = [(sid,) for sid, (data, _) in batch.items() if data is None]
+            try:
+                with self._conn:
+                    if upserts:
+                        self._conn.executemany("INSERT OR REPLACE INTO sessions (session_id, state, updated_at, version) VALUES (?, ?, ?, ?)", upserts)
+                    if deletes:
+                        self._conn.executemany("DELETE FROM sessions WHERE session_id = ?", deletes)
+            except sqlite3.Error:
+                # Lot remis en attente (sans écraser les versions plus récentes) pour le prochain essai
+                with self._lock:
+                    self._pending = {**batch, **self._pending}
+                raise
+            finally:
+                with self._lock:
+                    self._inflight = {}
+            self.stats["writes"] += len(batch)
+            self.stats["commits"] += 1
+
+    def _write_if_version(self, session_id, data, version, expected_version):
+        """
+        Écriture conditionnelle (compare-and-set) : BEGIN IMMEDIATE prend le verrou d'écriture
+        de la base avant la lecture, aucun autre processus ne peut écrire entre les deux
+        """
+        with self._db_lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT version FROM sessions WHERE session_id = ?", (session_id,)
+                ).fetchone()
+                current = row[0] if row else None
+                if current != expected_version:
+                    raise SessionConflict(f"Session {session_id} modifiée par un autre worker")
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO sessions (session_id, state, updated_at, version) VALUES (?, ?, ?, ?)",
+                    (session_id, data, time.time(), version),
+                )
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+        self.stats["writes"] += 1
+        self.stats["commits"] += 1
+
+    def acquire_lease(self, session_id, owner, ttl=SESSION_LEASE_TTL):
+        """
+        Prend le bail de la session s'il est libre, expiré ou déjà à `owner`. Retourne True si obtenu
+        """
+        self._ensure_started()
+        now = time.time()
+        with self._db_lock:
+            with self._conn:
+                cursor = self._conn.execute(
+                    "INSERT INTO session_leases (session_id, owner, expires_at) VALUES (?, ?, ?)"
+                    " ON CONFLICT(session_id) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at"
+                    " WHERE session_leases.expires_at < ? OR session_leases.owner = excluded.owner",
+                    (session_id, owner, now + ttl, now),
+                )
+        return cursor.rowcount == 1
+
+    def release_lease(self, session_id, owner):
+        self._ensure_started()
+        with self._db_lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM session_leases WHERE session_id = ? AND owner = ?", (session_id, owner))
+
+    def _write_loop(self):
+        while True:
+            with self._lock:
+                if not self._closed and len(self._pending) < self.flush_batch:
+                    self._wakeup.wait(self.flush_interval)
+                closed = self._closed
+            try:
+                self._write_pending()
+            except sqlite3.Error as e:
+                print(f"⚠️ Écriture des sessions impossible : {e}")
+            if closed:
+                return
+
+    def flush(self):
+        """
+        Écrit immédiatement les sessions en attente
+        """
+        if self._pid != os.getpid():
+            return
+        self._write_pending()
+
+    def close(self):
+        if self._pid != os.getpid() or self._closed:
+            return
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+        self._writer.join(timeout=5)
+
+
+session_backend = None
+
+def get_session_backend():
+    """
+    Backend de persistance des sessions (désactivé si SESSION_DB_PATH est vide)
+    """
+    global session_backend
+    if session_backend is None:
+        path = os.getenv('SESSION_DB_PATH', DEFAULT_SESSION_DB)
+        session_backend = SQLiteSessionBackend(path) if path else False
+        if session_backend:
+            # Sessions encore en attente écrites à l'arrêt du processus
+            atexit.register(session_backend.close)
+    return session_backend if session_backend is not False else None
@@ -0,0 +1,326 @@
+"""
+Stockage des conversations par session_id : chaque appelant a son propre State
+
+Les sessions sont bornées en nombre (LRU), expirées après une période d'inactivité (TTL)
+et comptabilisées en mémoire (taille estimée de l'historique) ; l'historique d'une session
+est lui-même limité aux derniers messages
+
+Un backend de persistance (session_backend.SQLiteSessionBackend par défaut) peut être branché :
+la mémoire sert alors de cache devant le backend, qui reçoit chaque State sauvegardé.
+Si le backend est partagé entre workers, la version d'une session en mémoire est comparée
+à celle du backend avant chaque tour, et la session est relue si un autre worker l'a modifiée
+
+Les tours d'une même session sont sérialisés (un asyncio.Lock par session, plus un bail
+dans le backend partagé entre workers) et un message identique envoyé pendant que le premier
+est en cours (double clic) reçoit la même réponse
+"""
+import asyncio
+import contextlib
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from setup_graph import State
+from session_backend import get_session_backend, SessionConflict, NO_CHECK
+
+SESSION_MAX = int(os.getenv('SESSION_MAX', 1000))
+SESSION_TTL = float(os.getenv('SESSION_TTL', 3600))
+SESSION_MAX_BYTES = int(os.getenv('SESSION_MAX_BYTES', 100 * 1024 * 1024))
+SESSION_MAX_MESSAGES = int(os.getenv('SESSION_MAX_MESSAGES', 40))
+
+
+def estimate_state_size(state):
+    """
+    Taille approximative (octets) d'un State : contenu des messages + infos collectées
+    """
+    size = sys.getsizeof(state)
+    for message in state.messages:
+        content = message.content if isinstance(message.content, str) else str(message.content)
+        size += sys.getsizeof(message) + len(content.encode('utf-8'))
+    size += sum(len(str(v)) for v in state.necessary_info_for_road.values())
+    return size
+
+
+def trim_history(state, max_messages=SESSION_MAX_MESSAGES):
+    """
+    Garde le message d'accueil et les `max_messages` derniers messages
+    """
+    if max_messages and len(state.messages) > max_messages + 1:
+        state.messages = state.messages[:1] + state.messages[-max_messages:]
+    return state
+
+
+class SessionStore():
+    def __init__(self, max_sessions=SESSION_MAX, ttl=SESSION_TTL, max_bytes=SESSION_MAX_BYTES,
+                 max_messages=SESSION_MAX_MESSAGES, backend=None):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+        # session_id -> {"state", "last_access", "size", "version"}, du moins au plus récemment utilisé
+        self.sessions = OrderedDict()
+        self.total_bytes = 0
+        # Objet avec load_versioned / save / delete, et version si shared (None : sessions en mémoire seulement)
+        self.backend = backend if backend is not None else get_session_backend()
+        self.stats = {"created": 0, "restored": 0, "stale": 0, "expired": 0, "evicted": 0, "coalesced": 0, "conflicts": 0}
+        self._lock = threading.Lock()
+        # session_id -> [asyncio.Lock, nombre de tours en cours ou en attente]
+        self._turn_locks = {}
+        # (type de tour, session_id, message) -> Future du résultat du tour en cours ;
+        # run_turn et stream_turn ne produisent pas le même résultat, ils ne se fusionnent pas
+        self._inflight = {}
+        # Identifiant du titulaire des baux de session (le pid distingue les workers forkés)
+        self._owner_id = uuid.uuid4().hex
+
+    @property
+    def shared(self):
+        return self.backend is not None and getattr(self.backend, "shared", False)
+
+    @property
+    def owner(self):
+        return f"{os.getpid()}:{self._owner_id}"
+
+    def get(self, session_id):
+        """
+        State de la session : en mémoire, sinon relu depuis le backend, sinon nouveau
+        """
+        return self.get_versioned(session_id)[0]
+
+    def get_versioned(self, session_id):
+        """
+        (State, version lue) ; la version sert de condition à la sauvegarde en mode partagé
+        """
+        shared = self.shared
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            entry = self.sessions.get(session_id)
+            if entry is not None:
+                entry["last_access"] = now
+                self.sessions.move_to_end(session_id)
+                if not shared:
+                    return entry["state"], entry["version"]
+                cached_version = entry["version"]
+
+        if entry is not None:
+            if self.backend.version(session_id) == cached_version:
+                return entry["state"], cached_version
+            # Modifiée (ou supprimée) par un autre worker : copie locale périmée
+            with self._lock:
+                old = self.sessions.pop(session_id, None)
+                if old is not None:
+                    self.total_bytes -= old["size"]
+                self.stats["stale"] += 1
+
+        state, version = self.backend.load_versioned(session_id) if self.backend is not None else (None, None)
+        with self._lock:
+            # Une autre requête a pu créer la session pendant la lecture
+            entry = self.sessions.get(session_id)
+            if entry is None:
+                if state is not None:
+                    self.stats["restored"] += 1
+                else:
+                    state = State()
+                    self.stats["created"] += 1
+                entry = {"state": state, "last_access": time.monotonic(), "size": estimate_state_size(state), "version": version}
+                self.sessions[session_id] = entry
+                self.total_bytes += entry["size"]
+                self._evict(keep=session_id)
+            return entry["state"], entry["version"]
+
+    def save(self, session_id, state, expected_version=NO_CHECK):
+        """
+        Enregistre le State après un tour de conversation : historique tronqué,
+        taille recalculée, puis éviction LRU si une limite est dépassée.
+        expected_version : version lue en début de tour (SessionConflict si le backend a changé)
+        """
+        trim_history(state, self.max_messages)
+        size = estimate_state_size(state)
+        try:
+            version = self.backend.save(session_id, state, expected_version) if self.backend is not None else None
+        except SessionConflict:
+            # La copie en mémoire contient le tour rejeté : la prochaine lecture repart du backend
+            with self._lock:
+                old = self.sessions.pop(session_id, None)
+                if old is not None:
+                    self.total_bytes -= old["size"]
+                self.stats["conflicts"] += 1
+            raise
+        with self._lock:
+            old = self.sessions.pop(session_id, None)
+            if old is not None:
+                self.total_bytes -= old["size"]
+            self.sessions[session_id] = {"state": state, "last_access": time.monotonic(), "size": size, "version": version}
+            self.total_bytes += size
+            self._evict(keep=session_id)
+
+    async def aget_versioned(self, session_id):
+        """
+        get_versioned() depuis le handler async : les lectures SQLite (et l'attente de busy_timeout)
+        se font dans un thread, sans bloquer la boucle d'événements du worker
+        """
+        if self.backend is None:
+            return self.get_versioned(session_id)
+        return await asyncio.to_thread(self.get_versioned, session_id)
+
+    async def asave(self, session_id, state, expected_version=NO_CHECK):
+        if self.backend is None:
+            return self.save(session_id, state, expected_version)
+        return await asyncio.to_thread(self.save, session_id, state, expected_version)
+
+    def delete(self, session_id):
+        with self._lock:
+            entry = self.sessions.pop(session_id, None)
+            if entry is not None:
+                self.total_bytes -= entry["size"]
+        if self.backend is not None:
+            if entry is None and self.backend.load(session_id) is not None:
+                entry = True
+            self.backend.delete(session_id)
+        return entry is not None
+
+    def close(self):
+        """
+        Écrit les sessions encore en attente dans le backend
+        """
+        if self.backend is not None:
+            self.backend.close()
+
+    def _expire(self, now):
+        # Les sessions sont triées par dernier accès : les expirées sont en tête
+        while self.sessions:
+            session_id, entry = next(iter(self.sessions.items()))
+            if now - entry["last_access"] < self.ttl:
+                break
+            self.sessions.popitem(last=False)
+            self.total_bytes -= entry["size"]
+            self.stats["expired"] += 1
+
+    def _evict(self, keep=None):
+        while len(self.sessions) > self.max_sessions or (self.total_bytes > self.max_bytes and len(self.sessions) > 1):
+            session_id, entry = next(iter(self.sessions.items()))
+            if session_id == keep:
+                break
+            self.sessions.popitem(last=False)
+            self.total_bytes -= entry["size"]
+            self.stats["evicted"] += 1
+
+    @contextlib.asynccontextmanager
+    async def turn_lock(self, session_id):
+        """
+        Verrou du tour de conversation : un seul tour à la fois par session,
+        les sessions différentes restent indépendantes
+        """
+        entry = self._turn_locks.get(session_id)
+        if entry is None:
+            entry = self._turn_locks[session_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                if not self.shared:
+                    yield
+                    return
+                # Entre workers : bail dans le backend, attendu avec un délai croissant
+                delay = 0.05
+                while not await asyncio.to_thread(self.backend.acquire_lease, session_id, self.owner):
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, 0.5)
+                try:
+                    yield
+                finally:
+                    await asyncio.to_thread(self.backend.release_lease, session_id, self.owner)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._turn_locks[session_id]
+
+    def _begin(self, kind, session_id, message):
+        """
+        (future, True) pour un nouveau tour, (future du tour en cours, False) pour un doublon
+        """
+        key = (kind, session_id, message)
+        future = self._inflight.get(key)
+        if future is not None:
+            self.stats["coalesced"] += 1
+            return future, False
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        return future, True
+
+    def _end(self, kind, session_id, message, future, result=None, error=None):
+        del self._inflight[(kind, session_id, message)]
+        if future.done():
+            return
+        if error is None:
+            future.set_result(result)
+        elif isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+            future.cancel()
+        else:
+            future.set_exception(error)
+            # Évite l'avertissement "exception was never retrieved" s'il n'y a pas de doublon
+            future.exception()
+
+    async def run_turn(self, session_id, message, turn):
+        """
+        Exécute `await turn(state)` sous le verrou de la session puis sauvegarde le State.
+        Un doublon en cours attend et reçoit le même résultat
+        """
+        future, owner = self._begin("run", session_id, message)
+        if not owner:
+            return await asyncio.shield(future)
+        try:
+            async with self.turn_lock(session_id):
+                state, version = await self.aget_versioned(session_id)
+                result = await turn(state)
+                await self.asave(session_id, state, version)
+        except BaseException as e:
+            self._end("run", session_id, message, future, error=e)
+            raise
+        self._end("run", session_id, message, future, result=result)
+        return result
+
+    async def stream_turn(self, session_id, message, turn):
+        """
+        Version streaming de run_turn : `turn(state)` est un générateur asynchrone d'événements.
+        Le State est sauvegardé avant l'envoi du dernier événement ; un doublon
+        ne reçoit que ce dernier événement
+        """
+        future, owner = self._begin("stream", session_id, message)
+        if not owner:
+            yield await asyncio.shield(future)
+            return
+        last = None
+        try:
+            async with self.turn_lock(session_id):
+                state, version = await self.aget_versioned(session_id)
+                # Chaque événement est retenu jusqu'à l'arrivée du suivant
+                async for event in turn(state):
+                    if last is not None:
+                        yield last
+                    last = event
+                await self.asave(session_id, state, version)
+        except BaseException as e:
+            self._end("stream", session_id, message, future, error=e)
+            raise
+        self._end("stream", session_id, message, future, result=last)
+        if last is not None:
+            yield last
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def info(self):
+        return {
+            "sessions": len(self.sessions),
+            "bytes": self.total_bytes,
+            "max_sessions": self.max_sessions,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "persistent": self.backend is not None,
+            "shared": self.shared,
+            "turns_in_progress": len(self._inflight),
+            **self.stats,
+        }
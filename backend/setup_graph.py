@@ -7,20 +7,38 @@ from langchain_mistralai.chat_models import ChatMistralAI
 from langchain_core.prompts import ChatPromptTemplate
 # from IPython.display import Image, display
 from langchain_core.runnables.graph import MermaidDrawMethod
-from langchain_core.runnables import Runnable
+from langchain_core.runnables import Runnable, RunnableLambda
+from langchain_core.utils.json import parse_partial_json
 from langgraph.graph import START, StateGraph
 from datetime import datetime
+import asyncio
+import importlib.util
+import httpx
 import os
 import warnings
 warnings.filterwarnings('ignore', message='Could not download mistral tokenizer')
 from dotenv import load_dotenv
 load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
 
-from embedding import select_top_n_similar_documents
+from embedding import select_top_n_similar_documents, aselect_top_n_similar_documents, build_rag_context
 from create_db import create_documents, save_documents
-from list import longlist
+from store import load_index, DEFAULT_STORE
+from fast_intent import get_fast_intent_classifier, slot_filling_in_progress, last_user_text, STICKY_INTENT
+from speculation import Speculator, SPECULATIVE_EXECUTION
+from slot_parser import parse_slots, is_fully_parsed, merge_slots, next_missing_slot, next_question, detect_language
+
+# Index chargé une seule fois au démarrage (matrice mappée en mémoire)
+longlist_index = load_index(os.getenv('EMBEDDINGS_STORE', DEFAULT_STORE))
 
 MISTRAL_MODEL = os.getenv('MISTRAL_MODEL', 'mistral-7b-instruct-v0.1')
+MISTRAL_BASE_URL = os.getenv('MISTRAL_BASE_URL', 'https://api.mistral.ai/v1')
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', 120))
+LLM_MAX_CONNECTIONS = int(os.getenv('LLM_MAX_CONNECTIONS', 20))
+LLM_MAX_KEEPALIVE = int(os.getenv('LLM_MAX_KEEPALIVE', 10))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv('LLM_KEEPALIVE_EXPIRY', 60))
+
+# Noeuds dont le champ "response" est affiché à l'utilisateur : seuls ceux-là sont streamés
+STREAMED_NODES = ("off_topic_agent", "specific_info_agent", "itinerary_info_agent", "road_in_versailles_agent")
 
 INIT_MESSAGE = "Bonjour ! Je suis votre assistant virtuel pour organiser votre visite au château de Versailles. " \
 "Je peux soit vous créer un itinéraire pour votre visite à partir de votre situation (visite en famille, " \
@@ -37,17 +55,66 @@ class State(BaseModel):
     user_asks_off_topic : bool | None = None
     user_wants_specific_info : bool | None = None
     necessary_info_for_road : Dict = {"date": None, "hour": None, "group_type": None, "time_of_visit": None, "budget": None}
+    # Résultat de l'exécution spéculative, le temps de passer de intent_node au noeud suivant
+    speculative : Dict | None = None
+    # Recherche RAG lancée par ItineraryInfoAgent dès que toutes les infos sont connues :
+    # {"query", "task"} (tâche asyncio), utilisée par RoadInVersaillesAgent si la requête correspond
+    rag_context : Dict | None = None
+
+def build_http_clients() -> tuple[httpx.Client, httpx.AsyncClient]:
+    """Clients HTTP du LLM : keep-alive, connexions bornées, HTTP/2 si le paquet h2 est installé"""
+    options = dict(
+        base_url=MISTRAL_BASE_URL,
+        headers={
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+            "Authorization": f"Bearer {os.getenv('MISTRAL_API_KEY')}",
+        },
+        timeout=LLM_TIMEOUT,
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        ),
+        http2=importlib.util.find_spec('h2') is not None,
+    )
+    return httpx.Client(**options), httpx.AsyncClient(**options)
 
 class LLMManager():
     def __init__(self):
-        self.llm = ChatMistralAI(model=MISTRAL_MODEL, temperature=0)
-
-    def structured_invoke(self, prompt: ChatPromptTemplate, output_model: type[BaseModel], **kwargs) -> str:
-        structured_llm = self.llm.with_structured_output(output_model)
-        messages = prompt.format_messages(**kwargs)
-        response = structured_llm.invoke(messages)
+        client, async_client = build_http_clients()
+        self.llm = ChatMistralAI(model=MISTRAL_MODEL, temperature=0, endpoint=MISTRAL_BASE_URL,
+                                 client=client, async_client=async_client)
+        # Registre des runnables (prompt | llm structuré), construits une seule fois par agent
+        self.runnables: Dict[str, Runnable] = {}
+
+    def get_runnable(self, name: str, prompt: ChatPromptTemplate, output_model: type[BaseModel],
+                     method: str = "function_calling") -> Runnable:
+        """method="json_mode" : le JSON demandé par le prompt arrive comme contenu du message,
+        streamé token par token (les arguments d'un appel d'outil peuvent arriver d'un seul bloc)"""
+        if name not in self.runnables:
+            self.runnables[name] = prompt | self.llm.with_structured_output(output_model, method=method)
+        return self.runnables[name]
+
+    def structured_invoke(self, prompt: ChatPromptTemplate, output_model: type[BaseModel], name: str | None = None, **kwargs) -> str:
+        # Seuls les prompts nommés sont gardés dans le registre : un prompt construit à la volée
+        # n'a pas d'identité stable
+        if name is not None:
+            runnable = self.get_runnable(name, prompt, output_model)
+        else:
+            runnable = prompt | self.llm.with_structured_output(output_model)
+        response = runnable.invoke(kwargs)
         return response
 
+llm_manager = None
+
+def get_llm_manager() -> LLMManager:
+    """Client LLM unique pour tout le processus, partagé par tous les agents"""
+    global llm_manager
+    if llm_manager is None:
+        llm_manager = LLMManager()
+    return llm_manager
+
 class IntentOutput(BaseModel):
     """Modèle pour la sortie de l'agent d'intention"""
     user_wants_road_in_versailles: bool = Field(description="L'utilisateur veut visiter le château")
@@ -55,44 +122,63 @@ class IntentOutput(BaseModel):
     user_asks_off_topic: bool = Field(description="L'utilisateur pose une question hors sujet")
 
 class IntentAgent():
-    def __init__(self):
-        self.llm = LLMManager()
+    PROMPT = ChatPromptTemplate.from_messages(
+        [('system', """You are an expert AI assistant that analyzes user messages to determine their
+        intent and extract relevant information. Your role is to identify if the user :
+          - wants to visit the castle in Versailles (set user_wants_road_in_versailles to true)
+          - wants specific information about something in the castle of Versailles (set user_wants_specific_info to true)
+          - is talking about something completely unrelated to Versailles castle (set user_asks_off_topic to true)
+
+        Examples of requests related to visiting the castle of Versailles:
+        - "I want to visit Versailles"
+        - "How can I plan a trip to the castle?"
+
+        Examples of requests related to specific information about the castle of Versailles:
+        - "Tell me about the Hall of Mirrors"
+        - "What are the opening hours of the gardens?"
+        - "Who designed the fountains in the gardens?"
+          
+        Examples of off-topic requests:
+        - "I want to visit the Tower of Pisa"
+        - "Tell me about cooking pasta"
+        - "What's the weather like?"
+          
+        Your response must be a JSON object (without markdown code blocks or any other formatting) with the following fields:
+        {{ user_wants_road_in_versailles: bool,
+            user_wants_specific_info: bool,
+        user_asks_off_topic: bool
+        }}
+        
+        IMPORTANT: Only ONE field can be true at a time. There has to be one true, the others has to be false.
+        You cannot have all 3 fields false or all 3 fields true.
+        CRITICAL : Be really careful to ALWAYS return a valid JSON object with the exact fields and types specified above.
+
+        """), ("human"," ===Messages: {messages}")])
+
+    def __init__(self, llm: LLMManager | None = None):
+        self.llm = llm or get_llm_manager()
+        self.structured_llm = self.llm.get_runnable("intent_agent", self.PROMPT, IntentOutput)
+        # Règles / centroïdes locaux : le LLM n'est appelé que si la décision est incertaine
+        self.fast_classifier = get_fast_intent_classifier()
 
     def get_user_intent(self, state: State) -> IntentOutput:
-        prompt = ChatPromptTemplate.from_messages(
-            [('system', """You are an expert AI assistant that analyzes user messages to determine their
-            intent and extract relevant information. Your role is to identify if the user :
-              - wants to visit the castle in Versailles (set user_wants_road_in_versailles to true)
-              - wants specific information about something in the castle of Versailles (set user_wants_specific_info to true)
-              - is talking about something completely unrelated to Versailles castle (set user_asks_off_topic to true)
-
-            Examples of requests related to visiting the castle of Versailles:
-            - "I want to visit Versailles"
-            - "How can I plan a trip to the castle?"
-
-            Examples of requests related to specific information about the castle of Versailles:
-            - "Tell me about the Hall of Mirrors"
-            - "What are the opening hours of the gardens?"
-            - "Who designed the fountains in the gardens?"
-              
-            Examples of off-topic requests:
-            - "I want to visit the Tower of Pisa"
-            - "Tell me about cooking pasta"
-            - "What's the weather like?"
-              
-            Your response must be a JSON object (without markdown code blocks or any other formatting) with the following fields:
-            {{ user_wants_road_in_versailles: bool,
-                user_wants_specific_info: bool,
-            user_asks_off_topic: bool
-            }}
-            
-            IMPORTANT: Only ONE field can be true at a time. There has to be one true, the others has to be false.
-            You cannot have all 3 fields false or all 3 fields true.
-            CRITICAL : Be really careful to ALWAYS return a valid JSON object with the exact fields and types specified above.
-
-            """), ("human"," ===Messages: {messages}")])
-
-        response = self.llm.structured_invoke(prompt, IntentOutput, messages=state.messages)
+        if self.fast_classifier is not None:
+            intent = self.fast_classifier.classify(state)
+            if intent is not None:
+                return intent
+        response = self.structured_llm.invoke(dict(messages=state.messages))
+        return self.format_intent(response)
+
+    async def aget_user_intent(self, state: State) -> IntentOutput:
+        if self.fast_classifier is not None:
+            intent = await self.fast_classifier.aclassify(state)
+            if intent is not None:
+                return intent
+        response = await self.structured_llm.ainvoke(dict(messages=state.messages))
+        return self.format_intent(response)
+
+    @staticmethod
+    def format_intent(response: IntentOutput) -> Dict[str, Any]:
         return {
             "user_wants_road_in_versailles": response.user_wants_road_in_versailles,
             "user_wants_specific_info": response.user_wants_specific_info,
@@ -100,25 +186,31 @@ class IntentAgent():
         }
 
 class OffTopicAgent():
-    def __init__(self):
-        self.llm = LLMManager()
+    PROMPT = ChatPromptTemplate.from_messages(
+        [('system', """You are an expert AI assistant specialised in handling off-topic questions.
+        Your role is to inform the user that you can only answer questions about the castle of Versailles.
+        If the user request is just a courtesy message (like "hello", "hi", "thanks", "bye"...), answer politely.
+        If the user asks about weather in Versailles for some date, check the MCP API and give the answer.
+        If the user asks about something related to Versailles but not the castle, answer it but 
+        be sure that he is not asking for something completely unrelated.
+        
+        Your response must be a JSON object (without markdown code blocks or any other formatting) with the following field:
+        {{ "response": str
+        }}
+        CRITICAL : Be really careful to ALWAYS return a valid JSON object with the exact fields and types specified above.
+        """), ("human"," ===Messages: {messages}  \n\n ===Your answer in the user's language : ")])
+
+    def __init__(self, llm: LLMManager | None = None):
+        self.llm = llm or get_llm_manager()
+        self.structured_llm = self.llm.get_runnable("off_topic_agent", self.PROMPT, SpecificInfoOutput, method="json_mode")
     
     def get_necessary_info(self, state: State) -> Dict[str, Any]:
-        prompt = ChatPromptTemplate.from_messages(
-            [('system', """You are an expert AI assistant specialised in handling off-topic questions.
-            Your role is to inform the user that you can only answer questions about the castle of Versailles.
-            If the user request is just a courtesy message (like "hello", "hi", "thanks", "bye"...), answer politely.
-            If the user asks about weather in Versailles for some date, check the MCP API and give the answer.
-            If the user asks about something related to Versailles but not the castle, answer it but 
-            be sure that he is not asking for something completely unrelated.
-            
-            Your response must be a JSON object (without markdown code blocks or any other formatting) with the following field:
-            {{ "response": str
-            }}
-            CRITICAL : Be really careful to ALWAYS return a valid JSON object with the exact fields and types specified above.
-            """), ("human"," ===Messages: {messages}  \n\n ===Your answer in the user's language : ")])
-        
-        response = self.llm.structured_invoke(prompt, SpecificInfoOutput, messages = state.messages)
+        response = self.structured_llm.invoke(dict(messages=state.messages))
+
+        return {"messages": AIMessage(content=response.response)}
+
+    async def aget_necessary_info(self, state: State) -> Dict[str, Any]:
+        response = await self.structured_llm.ainvoke(dict(messages=state.messages))
 
         return {"messages": AIMessage(content=response.response)}
 
@@ -127,27 +219,36 @@ class SpecificInfoOutput(BaseModel):
     response: str = Field(description="Réponse à la question spécifique sur le château de Versailles")
 
 class SpecificInfoAgent():
-    def __init__(self):
-        self.llm = LLMManager()
+    PROMPT = ChatPromptTemplate.from_messages(
+        [('system', """You are an expert AI assistant specialised in providing specific information about the 
+        castle of Versailles based on user questions.
+        Your role is to answer questions about the castle of Versailles using your knowledge.
+        If you don't know the answer, respond with "Désolé, je n'ai pas d'information là-dessus".
+        If the question is off-topic, respond with "Désolé, je ne peux répondre qu'à des questions sur le château de Versailles."
+        
+        Your response must be a JSON object (without markdown code blocks or any other formatting) with the following fields:
+        {{ "response": str
+        }}
+        CRITICAL : Be really careful to ALWAYS return a valid JSON object with the exact fields and types specified above.
+        """), ("human"," ===Messages: {messages}  \n\n ===Your answer in the user's language : ")])
+
+    def __init__(self, llm: LLMManager | None = None):
+        self.llm = llm or get_llm_manager()
+        self.structured_llm = self.llm.get_runnable("specific_info_agent", self.PROMPT, SpecificInfoOutput, method="json_mode")
     
     def get_necessary_info(self, state: State) -> Dict[str, Any]:
-        prompt = ChatPromptTemplate.from_messages(
-            [('system', """You are an expert AI assistant specialised in providing specific information about the 
-            castle of Versailles based on user questions.
-            Your role is to answer questions about the castle of Versailles using your knowledge.
-            If you don't know the answer, respond with "Désolé, je n'ai pas d'information là-dessus".
-            If the question is off-topic, respond with "Désolé, je ne peux répondre qu'à des questions sur le château de Versailles."
-            
-            Your response must be a JSON object (without markdown code blocks or any other formatting) with the following fields:
-            {{ "response": str
-            }}
-            CRITICAL : Be really careful to ALWAYS return a valid JSON object with the exact fields and types specified above.
-            """), ("human"," ===Messages: {messages}  \n\n ===Your answer in the user's language : ")])
-        
-        response = self.llm.structured_invoke(prompt, SpecificInfoOutput, messages = state.messages)
+        response = self.structured_llm.invoke(dict(messages=state.messages))
+
+        return {"messages": AIMessage(content=response.response)}
+
+    async def aget_necessary_info(self, state: State) -> Dict[str, Any]:
+        response = await self.structured_llm.ainvoke(dict(messages=state.messages))
 
         return {"messages": AIMessage(content=response.response)}
 
+def user_messages_text(state: State) -> str:
+    return ' '.join(m.content for m in state.messages if m.type == "human" and isinstance(m.content, str))
+
 class NecessaryInfoForRoad(BaseModel):
     """Modèle pour les informations nécessaires à l'itinéraire"""
     date: str | None = Field(default=None, description="Date de la visite")
@@ -162,43 +263,83 @@ class ItineraryInfoOutput(BaseModel):
     necessary_info_for_road: NecessaryInfoForRoad = Field(description="Les informations collectées")
 
 class ItineraryInfoAgent():
-    def __init__(self):
-        self.llm = LLMManager()
-    
-    def get_necessary_info(self, state: State) -> Dict[str, Any]:
-        prompt = ChatPromptTemplate.from_messages(
-            [('system', """You are an expert AI assistant specialised in creating plans to visit to the 
-            castle of Versailles based on different user situations.
-            Your role is to identify what is needed to plan the perfect visit to the castle in Versailles 
-            for the user and ask the required information found in the following dictionnary :
-            {necessary_info_for_road}
-            
-            Using the information given by the user fill the dictionnary and ask a question 
-            at a time starting by the dictionnary keys order.
-              
-            Today, the date is {current_date}, so if the user says "today" or "this weekend",
-            interpret it accordingly.
-            When you ask for the hours, precise the opening hours.
-            The user can response "10h", "10h00", "10:00", "10:00am", "10:00 am", "10 am", "10am" for 10 o'clock.
-            
-            If you have any doubt regarding the user answers, ask to clarify. Continue to ask questions 
-            until all fields are filled. If the user doesn't want to give a specific information, answer him
-            that your itinerary will be less precise. Ask again, if the user insists to not give the information,
-            set it to null.
-            If the user gives an answer that is not relevant to the question, ignore it and ask again the same question.
-            
-            Your response must be a JSON object (without markdown code blocks or any other formatting) with the following fields:
-            {{ "response": str,
-              "necessary_info_for_road": {{date: str | null, hour: str | null, group_type: str | null, 
-              time_of_visit: str | null, budget: str | null}}
-            }}
-            CRITICAL : Be really careful to ALWAYS return a valid JSON object with the exact fields and types specified above.
-            """), ("human"," ===Messages: {messages}  \n\n ===Your answer in the user's language : ")])
+    PROMPT = ChatPromptTemplate.from_messages(
+        [('system', """You are an expert AI assistant specialised in creating plans to visit to the 
+        castle of Versailles based on different user situations.
+        Your role is to identify what is needed to plan the perfect visit to the castle in Versailles 
+        for the user and ask the required information found in the following dictionnary :
+        {necessary_info_for_road}
+        
+        Using the information given by the user fill the dictionnary and ask a question 
+        at a time starting by the dictionnary keys order.
+          
+        Today, the date is {current_date}, so if the user says "today" or "this weekend",
+        interpret it accordingly.
+        When you ask for the hours, precise the opening hours.
+        The user can response "10h", "10h00", "10:00", "10:00am", "10:00 am", "10 am", "10am" for 10 o'clock.
+        
+        If you have any doubt regarding the user answers, ask to clarify. Continue to ask questions 
+        until all fields are filled. If the user doesn't want to give a specific information, answer him
+        that your itinerary will be less precise. Ask again, if the user insists to not give the information,
+        set it to null.
+        If the user gives an answer that is not relevant to the question, ignore it and ask again the same question.
         
-        response = self.llm.structured_invoke(prompt, ItineraryInfoOutput, messages=state.messages, necessary_info_for_road=state.necessary_info_for_road, current_date=datetime.today().strftime('%Y-%m-%d'))
+        Your response must be a JSON object (without markdown code blocks or any other formatting) with the following fields:
+        {{ "response": str,
+          "necessary_info_for_road": {{date: str | null, hour: str | null, group_type: str | null, 
+          time_of_visit: str | null, budget: str | null}}
+        }}
+        CRITICAL : Be really careful to ALWAYS return a valid JSON object with the exact fields and types specified above.
+        """), ("human"," ===Messages: {messages}  \n\n ===Your answer in the user's language : ")])
+
+    def __init__(self, llm: LLMManager | None = None):
+        self.llm = llm or get_llm_manager()
+        self.structured_llm = self.llm.get_runnable("itinerary_info_agent", self.PROMPT, ItineraryInfoOutput, method="json_mode")
+
+    @staticmethod
+    def prefill(state: State):
+        """
+        Lit localement les infos du dernier message (slot_parser).
+        Retourne (infos complétées, champs lus, question fixe si le message a été entièrement compris)
+        """
+        text = last_user_text(state)
+        if text is None:
+            return state.necessary_info_for_road, {}, None
+        parsed, residual = parse_slots(text, expected=next_missing_slot(state.necessary_info_for_road))
+        info = merge_slots(state.necessary_info_for_road, parsed)
+        if parsed and is_fully_parsed(residual):
+            return info, parsed, next_question(info, detect_language(user_messages_text(state)))
+        return info, parsed, None
+
+    def get_necessary_info(self, state: State) -> Dict[str, Any]:
+        info, parsed, question = self.prefill(state)
+        if question is not None:
+            return {"necessary_info_for_road": info, "messages": AIMessage(content=question)}
+        # Le LLM ne traite que ce qui reste ambigu : les champs déjà lus lui sont fournis
+        response = self.structured_llm.invoke(dict(messages=state.messages, necessary_info_for_road=info, current_date=datetime.today().strftime('%Y-%m-%d')))
+        return {
+            "necessary_info_for_road": merge_slots(response.necessary_info_for_road.model_dump(), parsed),
+            "messages": AIMessage(content=response.response),
+        }
+
+    async def aget_necessary_info(self, state: State) -> Dict[str, Any]:
+        info, parsed, question = self.prefill(state)
+        # Dernier champ lu par le parseur : la recherche RAG démarre tout de suite,
+        # pendant l'appel LLM ou le passage au noeud suivant
+        prefetch = RoadInVersaillesAgent.prefetch(info, state.rag_context)
+        if question is not None:
+            return {"necessary_info_for_road": info, "messages": AIMessage(content=question), "rag_context": prefetch}
+        try:
+            response = await self.structured_llm.ainvoke(dict(messages=state.messages, necessary_info_for_road=info, current_date=datetime.today().strftime('%Y-%m-%d')))
+        except BaseException:
+            RoadInVersaillesAgent.prefetch(None, prefetch)
+            raise
+        info = merge_slots(response.necessary_info_for_road.model_dump(), parsed)
         return {
-            "necessary_info_for_road": response.necessary_info_for_road.model_dump(),
+            "necessary_info_for_road": info,
             "messages": AIMessage(content=response.response),
+            # Dernier champ donné par le LLM : la recherche démarre avant RoadInVersaillesAgent
+            "rag_context": RoadInVersaillesAgent.prefetch(info, prefetch),
         }
 
 class ItineraryInfoOutputEval(BaseModel):
@@ -206,37 +347,61 @@ class ItineraryInfoOutputEval(BaseModel):
     necessary_info_for_road: NecessaryInfoForRoad = Field(description="Les informations collectées")
 
 class ItineraryInfoAgentEval():
-    def __init__(self):
-        self.llm = LLMManager()
-    
-    def get_necessary_info(self, state: State) -> Dict[str, Any]:
-        prompt = ChatPromptTemplate.from_messages(
-            [('system', """You are an expert AI assistant specialised in creating plans to visit to the 
-            castle of Versailles based on different user situations.
-            Your role is to identify what is needed to plan the perfect visit to the castle in Versailles 
-            for the user and ask the required information found in the following dictionnary :
-            {necessary_info_for_road}
-            
-            Using the information given by the user fill the dictionnary and ask a question 
-            at a time starting by the dictionnary keys order.
-              
-            Today, the date is {current_date}, so if the user says "today" or "this weekend",
-            interpret it accordingly.
-            When you ask for the hours, precise the opening hours.
-            The user can response "10h", "10h00", "10:00", "10:00am", "10:00 am", "10 am", "10am" for 10 o'clock.
-            
-            If you have any doubt regarding the user answers, set the field to null.
-            
-            Your response must be a JSON object (without markdown code blocks or any other formatting) with the following fields:
-            {{ "necessary_info_for_road": {{date: str | null, hour: str | null, group_type: str | null, 
-              time_of_visit: str | null, budget: str | null}}
-            }}
-            CRITICAL : Be really careful to ALWAYS return a valid JSON object with the exact fields and types specified above.
-            """), ("human"," ===Messages: {messages}  \n\n ===Your answer in the user's language : ")])
+    PROMPT = ChatPromptTemplate.from_messages(
+        [('system', """You are an expert AI assistant specialised in creating plans to visit to the 
+        castle of Versailles based on different user situations.
+        Your role is to identify what is needed to plan the perfect visit to the castle in Versailles 
+        for the user and ask the required information found in the following dictionnary :
+        {necessary_info_for_road}
+        
+        Using the information given by the user fill the dictionnary and ask a question 
+        at a time starting by the dictionnary keys order.
+          
+        Today, the date is {current_date}, so if the user says "today" or "this weekend",
+        interpret it accordingly.
+        When you ask for the hours, precise the opening hours.
+        The user can response "10h", "10h00", "10:00", "10:00am", "10:00 am", "10 am", "10am" for 10 o'clock.
         
-        response = self.llm.structured_invoke(prompt, ItineraryInfoOutputEval, messages=state.messages, necessary_info_for_road=state.necessary_info_for_road, current_date=datetime.today().strftime('%Y-%m-%d'))
+        If you have any doubt regarding the user answers, set the field to null.
+        
+        Your response must be a JSON object (without markdown code blocks or any other formatting) with the following fields:
+        {{ "necessary_info_for_road": {{date: str | null, hour: str | null, group_type: str | null, 
+          time_of_visit: str | null, budget: str | null}}
+        }}
+        CRITICAL : Be really careful to ALWAYS return a valid JSON object with the exact fields and types specified above.
+        """), ("human"," ===Messages: {messages}  \n\n ===Your answer in the user's language : ")])
+
+    def __init__(self, llm: LLMManager | None = None):
+        self.llm = llm or get_llm_manager()
+        self.structured_llm = self.llm.get_runnable("itinerary_info_agent_eval", self.PROMPT, ItineraryInfoOutputEval)
+
+    @staticmethod
+    def prefill(state: State):
+        """
+        Infos lues localement dans toute la demande : (infos complétées, champs lus)
+        """
+        parsed, _ = parse_slots(user_messages_text(state))
+        return merge_slots(state.necessary_info_for_road, parsed), parsed
+
+    def get_necessary_info(self, state: State) -> Dict[str, Any]:
+        info, parsed = self.prefill(state)
+        if next_missing_slot(info) is None:
+            # Tout a été compris sans LLM
+            return {"necessary_info_for_road": info}
+        response = self.structured_llm.invoke(dict(messages=state.messages, necessary_info_for_road=info, current_date=datetime.today().strftime('%Y-%m-%d')))
         return {
-            "necessary_info_for_road": response.necessary_info_for_road.model_dump()
+            "necessary_info_for_road": merge_slots(response.necessary_info_for_road.model_dump(), parsed)
+        }
+
+    async def aget_necessary_info(self, state: State) -> Dict[str, Any]:
+        info, parsed = self.prefill(state)
+        if next_missing_slot(info) is None:
+            return {"necessary_info_for_road": info, "rag_context": RoadInVersaillesAgent.prefetch(info, state.rag_context)}
+        response = await self.structured_llm.ainvoke(dict(messages=state.messages, necessary_info_for_road=info, current_date=datetime.today().strftime('%Y-%m-%d')))
+        info = merge_slots(response.necessary_info_for_road.model_dump(), parsed)
+        return {
+            "necessary_info_for_road": info,
+            "rag_context": RoadInVersaillesAgent.prefetch(info, state.rag_context),
         }
 
 class RoadOutput(BaseModel):
@@ -244,45 +409,118 @@ class RoadOutput(BaseModel):
     response: str = Field(description="L'itinéraire détaillé pour l'utilisateur")
 
 class RoadInVersaillesAgent():
-    def __init__(self):
-        self.llm = LLMManager()
+    PROMPT = ChatPromptTemplate.from_messages(
+        [('system', """You are an expert AI assistant specialised in organizing visits to the castle of Versailles.
+        Your role is to create a plan a visit to the castle in Versailles based on the information written in the 
+        following dictionnary :
+        {necessary_info_for_road}
+        If you have any doubt regarding the user answers, ask to clarify.
+        
+        To create the itinerary, consider the following:
+        - The date and hour of the visit to suggest activities that are open at that time.
+        - The type of group (family, friends, solo, etc.) to tailor the recommendations.
+        - The time of visit to suggest activities that fit within that timeframe.
+        - The budget to recommend activities that are affordable for the user.
+        
+        Here is some additional information about the castle of Versailles that might be useful:
+        {rag_context}
+          
+
+                      
+        Your response must be a JSON object (without markdown code blocks or any other formatting) with the following field:
+        {{ "response": str
+        }}
+        CRITICAL : Be really careful to ALWAYS return a valid JSON object with the exact fields and types specified above.
+        """), ("human"," ===Messages: {messages}  \n\n ===Your answer in the user's language : ")])
+
+    def __init__(self, llm: LLMManager | None = None):
+        self.llm = llm or get_llm_manager()
+        self.structured_llm = self.llm.get_runnable("road_in_versailles_agent", self.PROMPT, RoadOutput, method="json_mode")
     
+    @staticmethod
+    def format_query(necessary_info_for_road: Dict) -> str:
+        return "Le client veut visiter le château de Versailles le {date} à {hour} avec un groupe de type {group_type}. " \
+                          "Il prévoit de visiter pendant {time_of_visit} heures et son budget est {budget}.".format(**necessary_info_for_road)
+
+    @staticmethod
+    def get_query_client(state: State) -> str:
+        return RoadInVersaillesAgent.format_query(state.necessary_info_for_road)
+
+    @staticmethod
+    def search(query_client: str) -> str:
+        rag_context = select_top_n_similar_documents(query_client, documents=longlist_index, n=50, metric='euclidian')
+        return build_rag_context(rag_context)
+
+    @staticmethod
+    async def asearch(query_client: str) -> str:
+        rag_context = await aselect_top_n_similar_documents(query_client, documents=longlist_index, n=50, metric='euclidian')
+        return build_rag_context(rag_context)
+
+    @staticmethod
+    def prefetch(info: Dict | None, current: Dict | None = None) -> Dict | None:
+        """Lance la recherche RAG en tâche de fond dès que toutes les infos sont connues (chemin async).
+        Retourne {"query", "task"} ; une recherche en cours pour d'autres infos est annulée"""
+        query = RoadInVersaillesAgent.format_query(info) if info is not None and next_missing_slot(info) is None else None
+        if current is not None:
+            if current["query"] == query:
+                return current
+            current["task"].cancel()
+        if query is None:
+            return None
+        return {"query": query, "task": asyncio.create_task(RoadInVersaillesAgent.asearch(query))}
+
+    @staticmethod
+    def prefetched_context(state: State, query_client: str) -> asyncio.Task | None:
+        """Recherche lancée par ItineraryInfoAgent pour les mêmes informations, ou None"""
+        if state.rag_context is not None and state.rag_context.get("query") == query_client:
+            return state.rag_context["task"]
+        return None
+
     def get_necessary_info(self, state: State) -> Dict[str, Any]:
-        prompt = ChatPromptTemplate.from_messages(
-            [('system', """You are an expert AI assistant specialised in organizing visits to the castle of Versailles.
-            Your role is to create a plan a visit to the castle in Versailles based on the information written in the 
-            following dictionnary :
-            {necessary_info_for_road}
-            If you have any doubt regarding the user answers, ask to clarify.
-            
-            To create the itinerary, consider the following:
-            - The date and hour of the visit to suggest activities that are open at that time.
-            - The type of group (family, friends, solo, etc.) to tailor the recommendations.
-            - The time of visit to suggest activities that fit within that timeframe.
-            - The budget to recommend activities that are affordable for the user.
-            
-            Here is some additional information about the castle of Versailles that might be useful:
-            {rag_context}
-              
-
-                          
-            Your response must be a JSON object (without markdown code blocks or any other formatting) with the following field:
-            {{ "response": str
-            }}
-            CRITICAL : Be really careful to ALWAYS return a valid JSON object with the exact fields and types specified above.
-            """), ("human"," ===Messages: {messages}  \n\n ===Your answer in the user's language : ")])
-        query_client = "Le client veut visiter le château de Versailles le {date} à {hour} avec un groupe de type {group_type}. " \
-                          "Il prévoit de visiter pendant {time_of_visit} heures et son budget est {budget}.".format(**state.necessary_info_for_road)
-        rag_context = select_top_n_similar_documents(query_client, documents=longlist, n=50, metric='euclidian')
-        data=", ".join([doc['texte'] for doc in rag_context])
-
-        response = self.llm.structured_invoke(prompt, RoadOutput, messages=state.messages, necessary_info_for_road=state.necessary_info_for_road, rag_context=data, date=state.necessary_info_for_road.get('date'), hour=state.necessary_info_for_road.get('hour'))
+        # Le préchargement n'existe que sur le chemin async
+        data = self.search(self.get_query_client(state))
+
+        response = self.structured_llm.invoke(dict(messages=state.messages, necessary_info_for_road=state.necessary_info_for_road, rag_context=data, date=state.necessary_info_for_road.get('date'), hour=state.necessary_info_for_road.get('hour')))
+        return {
+            "messages": AIMessage(content=response.response),
+            "rag_context": None,
+        }
+
+    async def aget_necessary_info(self, state: State) -> Dict[str, Any]:
+        query_client = self.get_query_client(state)
+        prefetch = self.prefetched_context(state, query_client)
+        data = None
+        if prefetch is not None:
+            try:
+                data = await prefetch
+            except Exception as e:
+                print(f"⚠️ Préchargement du contexte RAG impossible : {e}")
+        elif state.rag_context is not None:
+            # Recherche lancée pour d'autres informations
+            state.rag_context["task"].cancel()
+        if data is None:
+            data = await self.asearch(query_client)
+
+        response = await self.structured_llm.ainvoke(dict(messages=state.messages, necessary_info_for_road=state.necessary_info_for_road, rag_context=data, date=state.necessary_info_for_road.get('date'), hour=state.necessary_info_for_road.get('hour')))
         return {
             "messages": AIMessage(content=response.response),
+            "rag_context": None,
         }
             # Go check the wheather with the MCP API to see if it will be sunny or rainy on that day at this date :
             # {date}, {hour} in Versailles, France.
 class Conditions():
+    @staticmethod
+    def route_start(
+        state: State,
+    ) -> Literal["intent_node", "itinerary_info_agent"]:
+        """Pendant la collecte des infos d'itinéraire, le message est une réponse à l'agent :
+        IntentAgent est sauté sauf si le détecteur de changement de sujet se déclenche."""
+        fast_classifier = get_fast_intent_classifier()
+        if STICKY_INTENT and fast_classifier is not None and slot_filling_in_progress(state):
+            if not fast_classifier.detects_drift(state):
+                return "itinerary_info_agent"
+        return "intent_node"
+
     @staticmethod
     def route_intent_node(
         state: State,
@@ -335,44 +573,57 @@ class Conditions():
         return "road_in_versailles_agent"
 
 class GraphManager():
-    def __init__(self):
-        self.agent = IntentAgent()
-        self.itineraryInfoAgent = ItineraryInfoAgent()
-        self.offTopicAgent = OffTopicAgent()
-        self.roadInVersaillesAgent = RoadInVersaillesAgent()
-        self.specificInfoAgent = SpecificInfoAgent()
+    def __init__(self, llm: LLMManager | None = None):
+        llm = llm or get_llm_manager()
+        self.agent = IntentAgent(llm)
+        self.itineraryInfoAgent = ItineraryInfoAgent(llm)
+        self.offTopicAgent = OffTopicAgent(llm)
+        self.roadInVersaillesAgent = RoadInVersaillesAgent(llm)
+        self.specificInfoAgent = SpecificInfoAgent(llm)
         self.conditions = Conditions()
+        # Mode spéculatif (chemin async) : l'agent suivant démarre pendant l'appel d'intention
+        self.speculator = Speculator(self.agent, {
+            "itinerary_info_agent": self.itineraryInfoAgent,
+            "specific_info_agent": self.specificInfoAgent,
+            "off_topic_agent": self.offTopicAgent,
+        }, self.conditions.route_intent_node)
+        # Graphe compilé une seule fois, réutilisé par toutes les requêtes
+        self.app: Runnable = self.create_workflow().compile()
+
+    def async_node(self, name, agent):
+        return self.speculator.node(name) if SPECULATIVE_EXECUTION else agent.aget_necessary_info
     
     def create_workflow(self) -> StateGraph:
         graph = StateGraph(State)
 
         graph.add_node(
             "intent_node",
-            self.agent.get_user_intent,
+            RunnableLambda(self.agent.get_user_intent,
+                           afunc=self.speculator.intent_node if SPECULATIVE_EXECUTION else self.agent.aget_user_intent),
             description="Determine user intent from messages",
         )
 
         graph.add_node(
             "off_topic_agent",
-            self.offTopicAgent.get_necessary_info,
+            RunnableLambda(self.offTopicAgent.get_necessary_info, afunc=self.async_node("off_topic_agent", self.offTopicAgent)),
             description="Handle off-topic questions",
         )
 
         graph.add_node(
             "specific_info_agent",
-            self.specificInfoAgent.get_necessary_info,
+            RunnableLambda(self.specificInfoAgent.get_necessary_info, afunc=self.async_node("specific_info_agent", self.specificInfoAgent)),
             description="Get specific information about the gardens of Versailles",
         )
 
         graph.add_node(
             "itinerary_info_agent",
-            self.itineraryInfoAgent.get_necessary_info,
+            RunnableLambda(self.itineraryInfoAgent.get_necessary_info, afunc=self.async_node("itinerary_info_agent", self.itineraryInfoAgent)),
             description="Get necessary info for visiting the gardens of Versailles",
         )
 
         graph.add_node(
             "road_in_versailles_agent",
-            self.roadInVersaillesAgent.get_necessary_info,
+            RunnableLambda(self.roadInVersaillesAgent.get_necessary_info, afunc=self.roadInVersaillesAgent.aget_necessary_info),
             description="Create itinerary for visiting Versailles",
         )
 
@@ -382,7 +633,7 @@ class GraphManager():
         graph.add_conditional_edges(
                     "itinerary_info_agent", self.conditions.route_road_pre_agent)
 
-        graph.add_edge(START, "intent_node")
+        graph.add_conditional_edges(START, self.conditions.route_start)
         graph.add_edge("road_in_versailles_agent", END)
         graph.add_edge("off_topic_agent", END)
         graph.add_edge("specific_info_agent", END)
@@ -390,12 +641,16 @@ class GraphManager():
         return graph
     
     def return_graph(self) -> Runnable:
-        return self.create_workflow().compile()
+        return self.app
     
     def run_agent(self, state: State) -> State:
         """Run the agent workflow and return the formatted answer."""
-        app: Runnable = self.create_workflow().compile()
-        result: State = app.invoke(state)
+        result: State = self.app.invoke(state)
+        return result
+
+    async def arun_agent(self, state: State) -> State:
+        """Async version of run_agent, used by the FastAPI endpoints."""
+        result: State = await self.app.ainvoke(state)
         return result
 
     def display_image(self):
@@ -438,44 +693,47 @@ class GraphManager():
         return mermaid_code
 
 class GraphManagerEval():
-    def __init__(self):
-        self.agent = IntentAgent()
-        self.itineraryInfoAgent = ItineraryInfoAgentEval()
-        self.offTopicAgent = OffTopicAgent()
-        self.roadInVersaillesAgent = RoadInVersaillesAgent()
-        self.specificInfoAgent = SpecificInfoAgent()
+    def __init__(self, llm: LLMManager | None = None):
+        llm = llm or get_llm_manager()
+        self.agent = IntentAgent(llm)
+        self.itineraryInfoAgent = ItineraryInfoAgentEval(llm)
+        self.offTopicAgent = OffTopicAgent(llm)
+        self.roadInVersaillesAgent = RoadInVersaillesAgent(llm)
+        self.specificInfoAgent = SpecificInfoAgent(llm)
         self.conditions = Conditions()
+        # Graphe compilé une seule fois, réutilisé par toutes les requêtes
+        self.app: Runnable = self.create_workflow().compile()
     
     def create_workflow(self) -> StateGraph:
         graph = StateGraph(State)
 
         graph.add_node(
             "intent_node",
-            self.agent.get_user_intent,
+            RunnableLambda(self.agent.get_user_intent, afunc=self.agent.aget_user_intent),
             description="Determine user intent from messages",
         )
 
         graph.add_node(
             "off_topic_agent",
-            self.offTopicAgent.get_necessary_info,
+            RunnableLambda(self.offTopicAgent.get_necessary_info, afunc=self.offTopicAgent.aget_necessary_info),
             description="Handle off-topic questions",
         )
 
         graph.add_node(
             "specific_info_agent",
-            self.specificInfoAgent.get_necessary_info,
+            RunnableLambda(self.specificInfoAgent.get_necessary_info, afunc=self.specificInfoAgent.aget_necessary_info),
             description="Get specific information about the gardens of Versailles",
         )
 
         graph.add_node(
             "itinerary_info_agent_eval",
-            self.itineraryInfoAgent.get_necessary_info,
+            RunnableLambda(self.itineraryInfoAgent.get_necessary_info, afunc=self.itineraryInfoAgent.aget_necessary_info),
             description="Get necessary info for visiting the gardens of Versailles",
         )
 
         graph.add_node(
             "road_in_versailles_agent",
-            self.roadInVersaillesAgent.get_necessary_info,
+            RunnableLambda(self.roadInVersaillesAgent.get_necessary_info, afunc=self.roadInVersaillesAgent.aget_necessary_info),
             description="Create itinerary for visiting Versailles",
         )
 
@@ -493,12 +751,16 @@ class GraphManagerEval():
         return graph
     
     def return_graph(self) -> Runnable:
-        return self.create_workflow().compile()
+        return self.app
     
     def run_agent(self, state: State) -> State:
         """Run the agent workflow and return the formatted answer."""
-        app: Runnable = self.create_workflow().compile()
-        result: State = app.invoke(state)
+        result: State = self.app.invoke(state)
+        return result
+
+    async def arun_agent(self, state: State) -> State:
+        """Async version of run_agent, used by the FastAPI endpoints."""
+        result: State = await self.app.ainvoke(state)
         return result
 
     def display_image(self):
@@ -542,19 +804,80 @@ class GraphManagerEval():
     
 from langchain_core.messages import HumanMessage
 
-def talk_to_agent(state, mgr, query=None):
-    query = input("You: ") if query is None else query
-    state.messages+=[HumanMessage(content = query)]
-    response = mgr.run_agent(state)
+def update_state(state, response):
     # Update state while preserving messages
     for key, value in response.items():
         if key != 'messages':
             setattr(state, key, value)
         else:
             state.messages = value
+
+def talk_to_agent(state, mgr, query=None):
+    query = input("You: ") if query is None else query
+    state.messages+=[HumanMessage(content = query)]
+    response = mgr.run_agent(state)
+    update_state(state, response)
     print("Agent:", state.messages[-1].content)
     return state.messages[-1].content
 
+async def atalk_to_agent(state, mgr, query):
+    state.messages+=[HumanMessage(content = query)]
+    response = await mgr.arun_agent(state)
+    update_state(state, response)
+    return state.messages[-1].content
+
+def partial_response(raw):
+    """
+    Champ "response" du JSON incomplet en cours de stream (contenu en json_mode,
+    ou arguments d'un appel d'outil)
+    """
+    try:
+        parsed = parse_partial_json(raw)
+    except Exception:
+        return None
+    response = parsed.get("response") if isinstance(parsed, dict) else None
+    return response if isinstance(response, str) else None
+
+async def astream_to_agent(state, mgr, query):
+    """
+    Version streaming de atalk_to_agent. Générateur d'événements :
+    - {"event": "node", "node": ...} à la fin de chaque noeud du graphe
+    - {"event": "token", "node": ..., "delta": ...} au fil de la génération de la réponse
+    - {"event": "done", "response": ..., "necessary_info_for_road": ...} une fois l'état mis à jour
+    """
+    state.messages+=[HumanMessage(content = query)]
+    raw_json, sent = {}, {}
+    final = None
+    async for mode, payload in mgr.app.astream(state, stream_mode=["messages", "updates", "values"]):
+        if mode == "messages":
+            chunk, metadata = payload
+            node = metadata.get("langgraph_node")
+            if node not in STREAMED_NODES:
+                continue
+            # La sortie structurée arrive morceau par morceau : contenu du message (json_mode)
+            # ou arguments d'appel d'outil (function_calling)
+            if isinstance(chunk.content, str):
+                raw_json[node] = raw_json.get(node, "") + chunk.content
+            for tool_call_chunk in getattr(chunk, "tool_call_chunks", None) or []:
+                raw_json[node] = raw_json.get(node, "") + (tool_call_chunk.get("args") or "")
+            text = partial_response(raw_json.get(node, ""))
+            already_sent = sent.get(node, "")
+            if text and len(text) > len(already_sent) and text.startswith(already_sent):
+                sent[node] = text
+                yield {"event": "token", "node": node, "delta": text[len(already_sent):]}
+        elif mode == "updates":
+            for node in payload:
+                yield {"event": "node", "node": node}
+        else:
+            final = payload
+
+    update_state(state, final)
+    yield {
+        "event": "done",
+        "response": state.messages[-1].content,
+        "necessary_info_for_road": state.necessary_info_for_road,
+    }
+
 if __name__ == "__main__":
     state = State()
     mgr = GraphManagerEval()
@@ -0,0 +1,428 @@
+"""
+Extraction déterministe (français / anglais) des informations d'itinéraire :
+date, heure, durée, budget et type de groupe, sans appel au LLM
+
+Formats produits (mêmes champs que NecessaryInfoForRoad) :
+- date : ISO "YYYY-MM-DD" (dates relatives résolues par rapport à `today`)
+- hour : "HH:MM"
+- time_of_visit : nombre d'heures décimal ("2.5", "4")
+- budget : "50 €", "50 € par personne" ou "économique" / "moyen" / "élevé" / "gratuit"
+- group_type : "solo", "couple", "famille", "amis", "groupe" ou "scolaire"
+
+Un champ ambigu (deux dates différentes, "3h" sans contexte...) n'est pas rempli : le LLM s'en charge
+"""
+import re
+from datetime import date, timedelta
+
+SLOTS = ("date", "hour", "group_type", "time_of_visit", "budget")
+
+MONTHS = {
+    "janvier": 1, "january": 1, "jan": 1, "février": 2, "fevrier": 2, "february": 2, "feb": 2,
+    "mars": 3, "march": 3, "avril": 4, "april": 4, "apr": 4, "mai": 5, "may": 5, "juin": 6, "june": 6,
+    "juillet": 7, "july": 7, "août": 8, "aout": 8, "august": 8, "aug": 8, "septembre": 9, "september": 9,
+    "sept": 9, "sep": 9, "octobre": 10, "october": 10, "oct": 10, "novembre": 11, "november": 11, "nov": 11,
+    "décembre": 12, "decembre": 12, "december": 12, "dec": 12,
+}
+WEEKDAYS = {
+    "lundi": 0, "monday": 0, "mardi": 1, "tuesday": 1, "mercredi": 2, "wednesday": 2, "jeudi": 3, "thursday": 3,
+    "vendredi": 4, "friday": 4, "samedi": 5, "saturday": 5, "dimanche": 6, "sunday": 6,
+}
+NUMBER_WORDS = {
+    "une": 1, "un": 1, "one": 1, "an": 1, "a": 1, "deux": 2, "two": 2, "trois": 3, "three": 3,
+    "quatre": 4, "four": 4, "cinq": 5, "five": 5, "six": 6,
+}
+MONTH_NAMES = '|'.join(sorted(MONTHS, key=len, reverse=True))
+WEEKDAY_NAMES = '|'.join(WEEKDAYS)
+
+ISO_DATE = re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b")
+NUMERIC_DATE = re.compile(r"\b(\d{1,2})[/.](\d{1,2})(?:[/.](\d{2,4}))?\b")
+DAY_MONTH = re.compile(rf"\b(\d{{1,2}})(?:er|st|nd|rd|th)?(?: of)? ({MONTH_NAMES})\.?(?: (\d{{4}}))?\b")
+MONTH_DAY = re.compile(rf"\b({MONTH_NAMES})\.? (\d{{1,2}})(?:st|nd|rd|th)?(?:,? (\d{{4}}))?\b")
+RELATIVE_DAY = re.compile(r"\b(aujourd'hui|today|après-demain|apres-demain|the day after tomorrow|demain|tomorrow|ce soir|tonight)\b")
+WEEKDAY = re.compile(rf"\b(?:(next|this|ce) )?({WEEKDAY_NAMES})(?: (prochain))?\b")
+WEEKEND = re.compile(r"\b(ce week-?end|this week-?end|le week-?end prochain|next week-?end)\b")
+
+# Heures : "10h", "10h30", "10:00", "10 am", "10:30pm", "14 heures", "midi"
+CLOCK = re.compile(r"\b(\d{1,2})\s*(?:(h|heures?|hours?)\s*(\d{2})?|:(\d{2}))(?:\s*(am|pm|a\.m\.|p\.m\.))?(?![\w€])")
+AMPM = re.compile(r"\b(\d{1,2})\s*(am|pm|a\.m\.|p\.m\.)(?!\w)")
+# "midi", mais pas "après-midi"
+NOON = re.compile(r"(?<!apr[eè]s-)(?<!apr[eè]s )\b(midi|noon)\b")
+HOUR_CONTEXT = re.compile(r"(?:\b(?:à|a|vers|at|around|dès|des|from|arriv\w*|commencer|start\w*|partir de)\s*)$")
+# "de" et "en" n'en font pas partie : "de 10h à 12h" est une plage horaire, "en 2h" reste ambigu
+DURATION_CONTEXT = re.compile(r"(?:\b(?:pendant|durant|for|during|environ|about|pour|durée|duration)\s*)$")
+# Plages horaires : "de 10h à 12h", "entre 14h et 17h", "from 9am to noon", "de 9h30 à midi"
+TIME_POINT = r"(?:(\d{1,2})\s*(?:(h|heures?|:)\s*(\d{2})?)?\s*(am|pm)?(?![\w€])|(midi|noon)\b)"
+TIME_RANGE = re.compile(
+    rf"\b(?:de|from|entre|between)\s+{TIME_POINT}\s*(?:à|a|au|to|till|until|et|and|-|jusqu'à)\s*{TIME_POINT}"
+)
+DURATION_SUFFIX = re.compile(r"^\s*(?:de visite|of visit|de balade|max|maximum|environ)")
+
+MINUTES = re.compile(r"\b(\d{1,3})\s*(?:min|mins|minutes?)\b")
+DECIMAL_HOURS = re.compile(r"\b(\d+[.,]\d+)\s*(?:h|heures?|hours?)(?!\w)")
+WORD_HOURS = re.compile(rf"\b({'|'.join(NUMBER_WORDS)})\s+(?:heures?|hours?)(?:\s+(?:et demie|and a half))?\b")
+# Seules les vraies durées comptent : "après-midi", "le matin" ne sont ni une heure ni une durée,
+# ils restent dans le texte non compris et le message va au LLM
+HALF_DAY = re.compile(r"\b(?:une |a |la )?(?:demi-?journée|demi-?journee|half(?: a|-)? ?day)\b")
+FULL_DAY = re.compile(r"\b(?:toute la journée|toute la journee|la journée|la journee|une journée(?: entière| complète)?|une journee|(?:a |the |one )?(?:full|whole|entire) day|all day)\b")
+
+# Effectifs ("2 adultes", "3 enfants") : précisent le groupe, ce ne sont ni des dates ni des heures
+HEADCOUNT = re.compile(r"\b\d+\s+(?:adultes?|adults?|enfants?|kids?|children|child|personnes?|people|persons?|élèves|eleves|students|ados|adolescents?|bébés?|bebes?|babies)\b")
+
+AMOUNT = re.compile(r"(?:\b(\d+(?:[.,]\d+)?)\s*(?:€|euros?|eur)(?!\w)|€\s*(\d+(?:[.,]\d+)?)\b)")
+BUDGET_AMOUNT = re.compile(r"\bbudget\s*(?:de|of|d'environ|environ|is|est|:|de l'ordre de)?\s*(\d+(?:[.,]\d+)?)\b(?!\s*(?:h|heures?|hours?|min))")
+PER_PERSON = re.compile(r"^\s*(?:par personne|per person|chacun|each|/\s*personne|pp)\b")
+BUDGET_LEVELS = [
+    ("gratuit", re.compile(r"\b(gratuit|gratuite|free|sans budget|no budget)\b")),
+    ("économique", re.compile(r"\b(petit budget|budget serré|budget serre|budget limité|budget limite|économique|economique|pas cher|pas trop cher|bon marché|cheap|low budget|tight budget|limited budget)\b")),
+    ("élevé", re.compile(r"\b(gros budget|grand budget|budget élevé|budget eleve|budget illimité|illimité|sans limite|no limit|high budget|big budget|large budget|unlimited)\b")),
+    ("moyen", re.compile(r"\b(budget moyen|moyen|moderate|medium budget|average budget|raisonnable|reasonable)\b")),
+]
+
+# "sans enfants", "pas d'amis", "without kids", "no children" : le type de groupe n'est pas celui-là
+NEGATION = re.compile(r"\b(?:sans|without|no|not with|aucune?|pas de|pas d')\s*(?:(?:les|mes|nos|the|my|our)\s+)?$")
+
+# Du plus spécifique au plus général
+GROUP_TYPES = [
+    ("scolaire", re.compile(r"\b(scolaire|sortie de classe|classe|élèves|eleves|school|students|pupils)\b")),
+    ("famille", re.compile(r"\b(famille|family|enfants?|kids?|children|child|bébé|bebe|baby|mes parents|my parents)\b")),
+    ("amis", re.compile(r"\b(amis|amies|copains|copines|potes|friends)\b")),
+    ("couple", re.compile(r"\b(couple|en amoureux|ma femme|mon mari|ma copine|mon copain|mon conjoint|ma conjointe|my wife|my husband|my girlfriend|my boyfriend|my partner)\b")),
+    ("solo", re.compile(r"\b(seul|seule|solo|alone|by myself|on my own|tout seul|toute seule)\b")),
+    ("groupe", re.compile(r"\b(groupe|group)\b")),
+]
+
+# Mots sans information propre : un message qui n'en contient pas d'autres est entièrement compris
+FILLER = set("""
+le la les l' un une des du de d' à a au aux en et ou puis vers pour avec sans par sur ce cet cette ces
+je j' nous on vous tu il elle ils elles c' est sommes serons serai suis sera viens venons venir arrive arriverons
+arriver arriverai visiter visite visit voudrais voudrions veux voulons souhaite souhaitons aimerais aimerions
+prévois prevois prévoyons compte comptons pense pensons plutôt plutot disons environ à peu près peu près
+budget heure heures durée duree max maximum idéalement idealement ok oui d'accord parfait merci svp
+s'il te plaît plait the an and or at on in for with we i i'm we're it's is are will be would like want
+to of by around about maybe probably ideally budget thanks please our my me us come coming arrive
+pendant durant during entre mes nos ma mon sortie personnes adultes adults people persons
+""".split())
+
+QUESTIONS = {
+    "fr": {
+        "date": "Quel jour souhaitez-vous visiter le château de Versailles ?",
+        "hour": "À quelle heure pensez-vous arriver ? Le château est ouvert de 9h à 18h30 d'avril à octobre "
+                "(17h30 de novembre à mars), tous les jours sauf le lundi.",
+        "group_type": "Avec qui venez-vous : seul, en couple, en famille, entre amis ou en groupe ?",
+        "time_of_visit": "Combien de temps souhaitez-vous consacrer à la visite (par exemple 2h30 ou une demi-journée) ?",
+        "budget": "Quel est votre budget pour la visite (billets, audioguide, restauration) ?",
+    },
+    "en": {
+        "date": "Which day would you like to visit the Palace of Versailles?",
+        "hour": "At what time do you plan to arrive? The palace is open from 9am to 6:30pm from April to October "
+                "(5:30pm from November to March), every day except Monday.",
+        "group_type": "Who are you coming with: alone, as a couple, with family, with friends or as a group?",
+        "time_of_visit": "How long would you like your visit to last (for example 2h30 or half a day)?",
+        "budget": "What is your budget for the visit (tickets, audio guide, food)?",
+    },
+}
+ACKNOWLEDGEMENT = {"fr": "C'est noté !", "en": "Got it!"}
+COMPLETE = {
+    "fr": "Merci, j'ai toutes les informations nécessaires : je prépare votre itinéraire.",
+    "en": "Thank you, I have everything I need: I am preparing your itinerary.",
+}
+
+ENGLISH_HINTS = re.compile(r"\b(the|i|i'm|we|we're|want|would|visit|today|tomorrow|with|my|our|family|friends|alone|hours?|day|and|for|at|around|budget is)\b")
+FRENCH_HINTS = re.compile(r"\b(le|la|les|je|nous|veux|voudrais|visiter|aujourd'hui|demain|avec|ma|mon|nos|famille|amis|seul|heures?|journée|et|pour|vers|à|en|c'est)\b")
+
+
+def normalize(text):
+    return ' '.join(text.lower().replace('’', "'").split())
+
+
+def detect_language(text):
+    """
+    "en" si le texte contient plus de mots anglais que de mots français, "fr" sinon
+    """
+    text = normalize(text)
+    return "en" if len(ENGLISH_HINTS.findall(text)) > len(FRENCH_HINTS.findall(text)) else "fr"
+
+
+def next_missing_slot(info):
+    """
+    Premier champ non rempli, dans l'ordre où l'agent pose les questions
+    """
+    return next((slot for slot in SLOTS if info.get(slot) is None), None)
+
+
+def format_hours(value):
+    return f"{round(value, 2):g}"
+
+
+def _future_date(today, month, day, year=None):
+    # Sans année : la prochaine occurrence de cette date
+    try:
+        candidate = date(year or today.year, month, day)
+        if year is None and candidate < today:
+            candidate = date(today.year + 1, month, day)
+    except ValueError:
+        return None
+    return candidate
+
+
+def _parse_dates(text, today):
+    found = []
+    for m in ISO_DATE.finditer(text):
+        try:
+            found.append((date(int(m[1]), int(m[2]), int(m[3])), m.span()))
+        except ValueError:
+            pass
+    for m in NUMERIC_DATE.finditer(text):
+        # Ordre français jour/mois
+        year = int(m[3]) if m[3] else None
+        if year is not None and year < 100:
+            year += 2000
+        value = _future_date(today, int(m[2]), int(m[1]), year)
+        if value is not None:
+            found.append((value, m.span()))
+    for m in DAY_MONTH.finditer(text):
+        value = _future_date(today, MONTHS[m[2]], int(m[1]), int(m[3]) if m[3] else None)
+        if value is not None:
+            found.append((value, m.span()))
+    for m in MONTH_DAY.finditer(text):
+        value = _future_date(today, MONTHS[m[1]], int(m[2]), int(m[3]) if m[3] else None)
+        if value is not None:
+            found.append((value, m.span()))
+    for m in RELATIVE_DAY.finditer(text):
+        word = m[1]
+        offset = 2 if word in ("après-demain", "apres-demain", "the day after tomorrow") else 1 if word in ("demain", "tomorrow") else 0
+        found.append((today + timedelta(days=offset), m.span()))
+    for m in WEEKEND.finditer(text):
+        # Le samedi à venir (aujourd'hui si on est samedi ou dimanche pour "ce week-end")
+        days = (5 - today.weekday()) % 7
+        if "prochain" in m[1] or "next" in m[1]:
+            days = days + 7 if today.weekday() < 5 and days else days or 7
+        elif today.weekday() == 6:
+            days = 0
+        found.append((today + timedelta(days=days), m.span()))
+    for m in WEEKDAY.finditer(text):
+        days = (WEEKDAYS[m[2]] - today.weekday()) % 7
+        if days == 0 and (m[1] == "next" or m[3] == "prochain"):
+            days = 7
+        found.append((today + timedelta(days=days), m.span()))
+    return found
+
+
+def _classify_clock(text, m, expected):
+    """
+    "hour", "duration" ou None pour un nombre suivi de h / heures
+    """
+    if m[4] is not None or m[5] is not None:
+        # "10:30", "10 am" : toujours une heure
+        return "hour"
+    before, after = text[:m.start()], text[m.end():]
+    if HOUR_CONTEXT.search(before):
+        return "hour"
+    if DURATION_CONTEXT.search(before) or DURATION_SUFFIX.match(after) or m[2].startswith("hour"):
+        return "duration"
+    if int(m[1]) > 8:
+        # Personne ne prévoit une visite de 9 heures ou plus
+        return "hour"
+    if expected == "hour":
+        return "hour"
+    if expected == "time_of_visit":
+        return "duration"
+    return None
+
+
+def _range_point(m, offset):
+    """
+    Heure décimale d'une borne de TIME_RANGE (groupes à partir de `offset`), None si non précisée
+    """
+    h, unit, minutes, meridiem, noon = m.group(offset, offset + 1, offset + 2, offset + 3, offset + 4)
+    if noon:
+        return 12.0, True
+    h, minutes = int(h), int(minutes or 0)
+    if meridiem == 'pm' and h < 12:
+        h += 12
+    elif meridiem == 'am' and h == 12:
+        h = 0
+    elif not meridiem and 1 <= h <= 7:
+        h += 12
+    if h > 23 or minutes > 59:
+        return None, False
+    return h + minutes / 60, bool(unit or meridiem)
+
+
+def _parse_time_ranges(text):
+    """
+    Plages horaires : (heure de début, durée, span). La durée est None si la plage est incohérente
+    (fin avant le début) : la plage n'est alors pas lue et le message va au LLM
+    """
+    found = []
+    for m in TIME_RANGE.finditer(text):
+        start, start_explicit = _range_point(m, 1)
+        end, end_explicit = _range_point(m, 6)
+        if start is None or end is None or not (start_explicit or end_explicit):
+            continue
+        if end <= start:
+            found.append((None, None, m.span()))
+            continue
+        hour = f"{int(start):02d}:{round(start % 1 * 60):02d}"
+        found.append((hour, format_hours(end - start), m.span()))
+    return found
+
+
+def _parse_hours_and_durations(text, expected):
+    hours, durations = [], []
+    ranges = _parse_time_ranges(text)
+    for hour, duration, span in ranges:
+        if hour is not None:
+            hours.append((hour, span))
+            durations.append((duration, span))
+
+    def in_range(position):
+        return any(start <= position < end for _, _, (start, end) in ranges)
+
+    for m in CLOCK.finditer(text):
+        if in_range(m.start()):
+            continue
+        h, minutes = int(m[1]), int(m[3] or m[4] or 0)
+        kind = _classify_clock(text, m, expected)
+        if kind == "hour":
+            if m[5] and m[5].startswith('p') and h < 12:
+                h += 12
+            elif m[5] and m[5].startswith('a') and h == 12:
+                h = 0
+            elif not m[5] and 1 <= h <= 7:
+                # "3h" sans am/pm : le château ouvre à 9h, il s'agit de l'après-midi
+                h += 12
+            if h <= 23 and minutes <= 59:
+                hours.append((f"{h:02d}:{minutes:02d}", m.span()))
+        elif kind == "duration" and m[4] is None and minutes <= 59:
+            durations.append((format_hours(h + minutes / 60), m.span()))
+    for m in AMPM.finditer(text):
+        h = int(m[1]) % 12 + (12 if m[2].startswith('p') else 0)
+        if not in_range(m.start()) and not any(start <= m.start() < end for _, (start, end) in hours):
+            hours.append((f"{h:02d}:00", m.span()))
+    for m in NOON.finditer(text):
+        if not in_range(m.start()):
+            hours.append(("12:00", m.span()))
+
+    for m in DECIMAL_HOURS.finditer(text):
+        if in_range(m.start()):
+            continue
+        durations.append((format_hours(float(m[1].replace(',', '.'))), m.span()))
+    for m in MINUTES.finditer(text):
+        if not any(start <= m.start() < end for _, (start, end) in hours + durations):
+            durations.append((format_hours(int(m[1]) / 60), m.span()))
+    for m in WORD_HOURS.finditer(text):
+        value = NUMBER_WORDS[m[1]] + (0.5 if m[0].endswith(("demie", "half")) else 0)
+        durations.append((format_hours(value), m.span()))
+    for m in HALF_DAY.finditer(text):
+        durations.append(("4", m.span()))
+    for m in FULL_DAY.finditer(text):
+        durations.append(("8", m.span()))
+    return hours, durations
+
+
+def _parse_budget(text):
+    found = []
+    for m in AMOUNT.finditer(text):
+        amount = float((m[1] or m[2]).replace(',', '.'))
+        value, end = f"{amount:g} €", m.end()
+        per_person = PER_PERSON.match(text[end:])
+        if per_person:
+            value, end = f"{value} par personne", end + per_person.end()
+        found.append((value, (m.start(), end)))
+    for m in BUDGET_AMOUNT.finditer(text):
+        if not any(start <= m.start(1) < stop for _, (start, stop) in found):
+            found.append((f"{float(m[1].replace(',', '.')):g} €", m.span()))
+    if not found:
+        for level, pattern in BUDGET_LEVELS:
+            m = pattern.search(text)
+            if m:
+                found.append((level, m.span()))
+                break
+    return found
+
+
+def _parse_group(text):
+    found = []
+    for group_type, pattern in GROUP_TYPES:
+        for m in pattern.finditer(text):
+            if NEGATION.search(text[:m.start()]):
+                continue
+            found.append((group_type, m.span()))
+    # "en famille avec les enfants" : un seul type ; "famille" l'emporte sur "groupe"
+    types = {value for value, _ in found}
+    if len(types) > 1 and types - {"groupe"} and "groupe" in types:
+        found = [(value, span) for value, span in found if value != "groupe"]
+    return found
+
+
+def _unique(candidates):
+    """
+    Valeur si tous les candidats sont d'accord, sinon None (ambigu)
+    """
+    values = {value for value, _ in candidates}
+    return values.pop() if len(values) == 1 else None
+
+
+def parse_slots(text, today=None, expected=None):
+    """
+    Extrait les champs d'itinéraire d'un message.
+    `expected` : champ sur lequel porte la dernière question (lève l'ambiguïté de "3h").
+    Retourne (champs trouvés, texte restant une fois les parties comprises retirées)
+    """
+    today = today or date.today()
+    text = normalize(text)
+    slots, spans = {}, []
+
+    # Les montants sont lus en premier : "50 €" n'est ni une heure ni une date
+    budgets = _parse_budget(text)
+    taken = [span for _, span in budgets]
+
+    def free(candidates):
+        return [(v, s) for v, s in candidates if not any(s[0] < e and b < s[1] for b, e in taken)]
+
+    hours, durations = _parse_hours_and_durations(text, expected)
+    hours, durations = free(hours), free(durations)
+    taken += [span for _, span in hours + durations]
+    dates = free([(d.isoformat(), span) for d, span in _parse_dates(text, today)])
+    groups = _parse_group(text)
+    spans += [m.span() for m in HEADCOUNT.finditer(text)]
+
+    for slot, candidates in (("date", dates), ("hour", hours), ("time_of_visit", durations),
+                             ("budget", budgets), ("group_type", groups)):
+        value = _unique(candidates)
+        if value is not None:
+            slots[slot] = value
+            spans += [span for _, span in candidates]
+
+    residual = list(text)
+    for start, end in spans:
+        residual[start:end] = ' ' * (end - start)
+    return slots, ''.join(residual)
+
+
+def is_fully_parsed(residual):
+    """
+    True si le texte restant ne contient que des mots sans information.
+    Un nombre restant (ex : "le 12", jour sans mois) n'a pas été compris : le LLM doit le voir ;
+    les effectifs ("2 adultes et 3 enfants") sont déjà retirés par parse_slots
+    """
+    words = re.findall(r"[\w'’-]+", residual.lower())
+    return all(word in FILLER or (len(word) <= 1 and not word.isdigit()) for word in words)
+
+
+def merge_slots(info, parsed):
+    """
+    Les valeurs lues dans le dernier message remplacent les anciennes (l'utilisateur se corrige)
+    """
+    return {**info, **{slot: value for slot, value in parsed.items() if value is not None}}
+
+
+def next_question(info, language="fr"):
+    """
+    Question fixe pour le prochain champ manquant, ou message de fin si tout est rempli
+    """
+    missing = next_missing_slot(info)
+    if missing is None:
+        return COMPLETE[language]
+    return f"{ACKNOWLEDGEMENT[language]} {QUESTIONS[language][missing]}"
@@ -0,0 +1,125 @@
+"""
+Exécution spéculative : l'agent le plus probable après IntentAgent est lancé en même temps
+que l'appel LLM d'intention
+
+La prédiction vient des règles de fast_intent (décision sous le seuil de confiance) ou, à défaut,
+de l'intention du tour précédent. Si le routage confirme la prédiction, le résultat déjà calculé
+est utilisé par le noeud suivant ; sinon la tâche est annulée et son coût estimé est compté
+"""
+import asyncio
+import os
+
+from embedding import estimate_tokens
+from fast_intent import ROAD, SPECIFIC, OFF_TOPIC, last_user_text
+
+SPECULATIVE_EXECUTION = os.getenv('SPECULATIVE_EXECUTION', '0').lower() in ('1', 'true', 'yes')
+
+# Noeud du graphe correspondant à chaque intention
+INTENT_NODES = {
+    ROAD: "itinerary_info_agent",
+    SPECIFIC: "specific_info_agent",
+    OFF_TOPIC: "off_topic_agent",
+}
+
+
+def prompt_size(prompt):
+    """
+    Nombre de caractères des gabarits d'un ChatPromptTemplate (hors variables)
+    """
+    return sum(len(getattr(getattr(m, 'prompt', None), 'template', '')) for m in prompt.messages)
+
+
+class Speculator():
+    def __init__(self, intent_agent, agents, route):
+        """
+        agents : nom du noeud -> agent (aget_necessary_info et PROMPT)
+        route : fonction de routage appliquée au State après IntentAgent
+        """
+        self.intent_agent = intent_agent
+        self.agents = agents
+        self.route = route
+        self.stats = {"turns": 0, "launched": 0, "hits": 0, "misses": 0, "skipped": 0, "wasted_tokens": 0}
+
+    def predict(self, state):
+        """
+        Noeud probable après IntentAgent, ou None s'il n'y a pas d'appel LLM à recouvrir
+        """
+        fast_classifier = self.intent_agent.fast_classifier
+        text = last_user_text(state)
+        if fast_classifier is not None and text is not None:
+            decision = fast_classifier.classify_rules(text, state)
+            if decision is not None:
+                intent, confidence, _ = decision
+                if confidence >= fast_classifier.threshold:
+                    # Décision sans LLM : rien à paralléliser
+                    return None
+                return INTENT_NODES[intent]
+        # Sinon : même intention qu'au tour précédent
+        for intent, node in INTENT_NODES.items():
+            if getattr(state, intent):
+                return node
+        return None
+
+    def wasted_tokens(self, node, state, task):
+        # Estimation : prompt complet envoyé, plus la réponse si elle a eu le temps d'arriver
+        tokens = estimate_tokens(' '.join(str(m.content) for m in state.messages))
+        tokens += prompt_size(self.agents[node].PROMPT) // 3
+        if task.done() and not task.cancelled() and task.exception() is None:
+            message = task.result().get("messages")
+            if message is not None:
+                tokens += estimate_tokens(str(message.content))
+        return tokens
+
+    async def intent_node(self, state):
+        """
+        Remplace IntentAgent.aget_user_intent dans le graphe : mêmes champs d'intention,
+        plus "speculative" ({"node", "result"}) quand la prédiction est confirmée
+        """
+        self.stats["turns"] += 1
+        node = self.predict(state)
+        if node is None:
+            self.stats["skipped"] += 1
+            return {**await self.intent_agent.aget_user_intent(state), "speculative": None}
+
+        self.stats["launched"] += 1
+        task = asyncio.create_task(self.agents[node].aget_necessary_info(state))
+        try:
+            intent = await self.intent_agent.aget_user_intent(state)
+        except BaseException:
+            task.cancel()
+            raise
+
+        if self.route(state.model_copy(update=intent)) == node:
+            self.stats["hits"] += 1
+            return {**intent, "speculative": {"node": node, "result": await task}}
+
+        task.cancel()
+        if task.done() and not task.cancelled() and task.exception() is None:
+            # Agent terminé avant la fin de IntentAgent : sa recherche RAG préchargée ne servira pas
+            prefetch = task.result().get("rag_context")
+            if prefetch is not None:
+                prefetch["task"].cancel()
+        self.stats["misses"] += 1
+        self.stats["wasted_tokens"] += self.wasted_tokens(node, state, task)
+        return {**intent, "speculative": None}
+
+    def node(self, name):
+        """
+        Version async du noeud `name` qui reprend le résultat spéculatif s'il lui est destiné
+        """
+        agent = self.agents[name]
+
+        async def run(state):
+            speculative = state.speculative
+            if speculative is not None and speculative["node"] == name:
+                return {**speculative["result"], "speculative": None}
+            return {**await agent.aget_necessary_info(state), "speculative": None}
+        return run
+
+    def info(self):
+        launched = self.stats["launched"]
+        return {
+            **self.stats,
+            "enabled": SPECULATIVE_EXECUTION,
+            "hit_rate": self.stats["hits"] / launched if launched else 0.0,
+        }
@@ -0,0 +1,154 @@
+"""
+Stockage binaire des embeddings : une matrice .npy (float32) + un fichier
+de métadonnées .meta.json (documents sans leur embedding, même ordre que les lignes)
+
+Le fichier .meta.json désigne la matrice à utiliser ; une écriture crée une nouvelle
+matrice puis remplace atomiquement les métadonnées. La génération précédente est gardée
+jusqu'à l'écriture suivante, et un lecteur qui ne trouve plus sa matrice relit les métadonnées
+"""
+import glob
+import hashlib
+import json
+import os
+import re
+import tempfile
+import numpy as np
+from embedding import VectorIndex, estimate_tokens, extract_text_from_content
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+DEFAULT_STORE = os.path.join(DATA_DIR, 'documents_embedded')
+DISPLAY_MAX_CHARS = int(os.getenv('DISPLAY_MAX_CHARS', 2000))
+
+# Liens du crawl : "(#)", "(https://...)"
+LINK_PATTERN = re.compile(r'\s*\((?:#|https?://[^)\s]*)\)')
+
+
+def store_prefix(prefix):
+    return os.path.splitext(prefix)[0] if prefix.endswith(('.json', '.jsonl', '.npy')) else prefix
+
+
+def display_text(text, max_chars=DISPLAY_MAX_CHARS):
+    """
+    Texte affiché dans le contexte RAG : liens retirés, espaces compactés, longueur bornée
+    """
+    text = ' '.join(LINK_PATTERN.sub('', text).split())
+    if len(text) > max_chars:
+        text = text[:max_chars].rsplit(' ', 1)[0] + '…'
+    return text
+
+
+def display_record(document):
+    """
+    Métadonnées stockées pour un document : le texte d'affichage et son nombre de tokens
+    sont précalculés, l'arbre `content` n'est pas conservé
+    """
+    record = {k: v for k, v in document.items() if k not in ("embedding", "content")}
+    if "texte" not in record:
+        record["texte"] = extract_text_from_content(document.get("content", ""))
+    record["texte"] = display_text(record["texte"])
+    record["n_tokens"] = estimate_tokens(record["texte"])
+    return record
+
+
+def atomic_write(path, write):
+    """
+    Écrit dans un fichier temporaire du même dossier puis le renomme (os.replace est atomique)
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix=os.path.basename(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp crée le fichier en 0600 : le rendre lisible par les autres processus
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def save_store(documents, prefix, matrix=None):
+    """
+    Sauvegarde les documents embeddés sous forme de matrice .npy + métadonnées.
+    Si matrix est fourni, les documents n'ont pas besoin de champ "embedding"
+    """
+    prefix = store_prefix(prefix)
+    if matrix is None:
+        matrix = np.array([doc["embedding"] for doc in documents], dtype=np.float32)
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    metadata = [display_record(doc) for doc in documents]
+
+    # La matrice est nommée d'après son contenu : une nouvelle version ne remplace jamais
+    # un fichier encore mappé par un autre processus
+    digest = hashlib.sha256(matrix.tobytes()).hexdigest()[:12]
+    matrix_name = f"{os.path.basename(prefix)}.{digest}.npy"
+    matrix_path = os.path.join(os.path.dirname(prefix), matrix_name)
+    meta_path = f"{prefix}.meta.json"
+
+    if not os.path.exists(matrix_path):
+        atomic_write(matrix_path, lambda f: np.save(f, matrix))
+    previous_name = read_matrix_name(meta_path)
+    meta = {"matrix": matrix_name, "documents": metadata}
+    atomic_write(meta_path, lambda f: f.write(json.dumps(meta, ensure_ascii=False).encode('utf-8')))
+
+    # Nettoyage des anciennes matrices (les processus qui les mappent gardent leur accès).
+    # La génération précédente reste disponible pour un lecteur qui vient de lire l'ancien .meta.json
+    keep = {matrix_name, previous_name}
+    for old_path in glob.glob(glob.escape(prefix) + '.*.npy') + [f"{prefix}.npy"]:
+        if os.path.exists(old_path) and os.path.basename(old_path) not in keep:
+            os.remove(old_path)
+
+    return matrix_path, meta_path
+
+
+def read_matrix_name(meta_path):
+    """
+    Nom de la matrice désignée par un .meta.json existant (None sinon)
+    """
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return meta.get("matrix") if isinstance(meta, dict) else os.path.basename(meta_path).replace('.meta.json', '.npy')
+
+
+def load_store(prefix=DEFAULT_STORE, mmap=True, retries=3):
+    """
+    Charge un store. La matrice est mappée en mémoire (pages partagées entre workers)
+    """
+    prefix = store_prefix(prefix)
+    meta_path = f"{prefix}.meta.json"
+    for attempt in range(retries + 1):
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if isinstance(meta, dict):
+            metadata = meta["documents"]
+            matrix_path = os.path.join(os.path.dirname(meta_path), meta["matrix"])
+        else:
+            # Ancien format : liste de documents + matrice {prefix}.npy
+            metadata = meta
+            matrix_path = f"{prefix}.npy"
+        try:
+            matrix = np.load(matrix_path, mmap_mode='r' if mmap else None)
+            break
+        except FileNotFoundError:
+            # Matrice supprimée par une réécriture entre la lecture du .meta.json et np.load :
+            # les nouvelles métadonnées désignent la nouvelle matrice
+            if attempt == retries:
+                raise
+
+    if len(metadata) != matrix.shape[0]:
+        raise ValueError(f"Store incohérent : {len(metadata)} documents pour {matrix.shape[0]} embeddings ({prefix})")
+    return metadata, matrix
+
+
+def load_index(prefix=DEFAULT_STORE, mmap=True):
+    """
+    Charge un store directement sous forme de VectorIndex
+    """
+    metadata, matrix = load_store(prefix, mmap=mmap)
+    return VectorIndex(metadata, matrix=matrix)
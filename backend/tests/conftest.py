@@ -0,0 +1,92 @@
+import asyncio
+import json
+import os
+import sys
+
+import httpx
+import pytest
+
+# Les modules du backend sont importés à plat (comme depuis backend/)
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('MISTRAL_API_KEY', 'test')
+os.environ['SESSION_DB_PATH'] = ''
+
+
+class FakeMistral():
+    """
+    Endpoint /v1/chat/completions hors-ligne. `answers` : liste de (texte du prompt système, réponse) ;
+    la première réponse dont le texte apparaît dans le prompt est renvoyée, en appel d'outil
+    (function_calling) ou en contenu JSON (json_mode), streamée par morceaux de `chunk_size` caractères.
+    `delay` : latence (secondes) de chaque appel async
+    """
+    def __init__(self, answers, chunk_size=6, delay=0):
+        self.answers = answers
+        self.chunk_size = chunk_size
+        self.delay = delay
+        self.requests = []
+
+    def answer(self, body):
+        system = body["messages"][0]["content"]
+        self.requests.append(body)
+        for marker, answer in self.answers:
+            if marker in system:
+                return json.dumps(answer, ensure_ascii=False)
+        raise AssertionError(f"Prompt inattendu : {system[:80]}")
+
+    def handler(self, request):
+        body = json.loads(request.content)
+        text = self.answer(body)
+        tools = body.get("tools")
+        if body.get("stream"):
+            return httpx.Response(200, content=self.sse(text, tools), headers={"content-type": "text/event-stream"})
+        message = {"role": "assistant", "content": "" if tools else text}
+        if tools:
+            message["tool_calls"] = [self.tool_call(tools, text)]
+        return httpx.Response(200, json={
+            "id": "x", "object": "chat.completion", "model": "fake",
+            "choices": [{"index": 0, "finish_reason": "tool_calls" if tools else "stop", "message": message}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+        })
+
+    async def ahandler(self, request):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        return self.handler(request)
+
+    @staticmethod
+    def tool_call(tools, arguments):
+        return {"id": "abcdefghi", "type": "function", "function": {"name": tools[0]["function"]["name"], "arguments": arguments}}
+
+    def sse(self, text, tools):
+        pieces = [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)]
+        if tools:
+            # Mistral envoie les arguments d'un appel d'outil en un seul morceau
+            deltas = [{"role": "assistant", "content": "", "tool_calls": [{**self.tool_call(tools, text), "index": 0}]}]
+        else:
+            deltas = [{"role": "assistant", "content": piece} for piece in pieces]
+        events = [{"id": "x", "object": "chat.completion.chunk", "model": "fake",
+                   "choices": [{"index": 0, "delta": delta, "finish_reason": None}]} for delta in deltas]
+        events.append({"id": "x", "object": "chat.completion.chunk", "model": "fake",
+                       "choices": [{"index": 0, "delta": {"content": ""}, "finish_reason": "tool_calls" if tools else "stop"}],
+                       "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15}})
+        lines = [f"data: {json.dumps(event)}" for event in events] + ["data: [DONE]"]
+        return ("\n\n".join(lines) + "\n\n").encode()
+
+
+@pytest.fixture
+def fake_mistral(monkeypatch):
+    """
+    Remplace les clients HTTP du LLM par le faux endpoint ; `fake.answers` est à remplir par le test
+    """
+    import setup_graph
+
+    fake = FakeMistral([])
+
+    def build_http_clients():
+        options = dict(base_url="https://fake/v1", headers={"Authorization": "Bearer test"})
+        return (httpx.Client(transport=httpx.MockTransport(fake.handler), **options),
+                httpx.AsyncClient(transport=httpx.MockTransport(fake.ahandler), **options))
+
+    monkeypatch.setattr(setup_graph, "build_http_clients", build_http_clients)
+    monkeypatch.setattr(setup_graph, "llm_manager", None)
+    return fake
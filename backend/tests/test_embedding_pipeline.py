@@ -0,0 +1,81 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import embedding
+from embedding_cache import EmbeddingCache
+from embedding_pipeline import AsyncEmbeddingPipeline
+
+
+def vector(text):
+    # "texte 7" -> [7.0, 0.5] : exact en float32, permet de vérifier l'ordre des résultats
+    return [float(text.split()[-1]), 0.5]
+
+
+class FakeEmbeddingAPI():
+    """
+    Endpoint /v1/embeddings hors-ligne : `fail_first` réponses 429 avant de répondre normalement
+    """
+    def __init__(self, fail_first=0):
+        self.fail_first = fail_first
+        self.requests = []
+
+    def __call__(self, request):
+        inputs = json.loads(request.content)["input"]
+        self.requests.append(inputs)
+        if self.fail_first:
+            self.fail_first -= 1
+            return httpx.Response(429, headers={"Retry-After": "0.01"}, text="rate limited")
+        # Données dans le désordre : le pipeline doit les remettre dans l'ordre des index
+        data = [{"index": i, "embedding": vector(t)} for i, t in enumerate(inputs)][::-1]
+        return httpx.Response(200, json={"data": data})
+
+
+@pytest.fixture
+def texts():
+    return [f"texte {i}" for i in range(7)]
+
+
+def make_pipeline(api, cache):
+    return AsyncEmbeddingPipeline(api_key="x", base_url="https://fake", concurrency=3,
+                                  requests_per_second=None, base_delay=0.01, cache=cache,
+                                  transport=httpx.MockTransport(api))
+
+
+def test_batches_keep_input_order(tmp_path, monkeypatch, texts):
+    monkeypatch.setattr(embedding, "MAX_BATCH_SIZE", 2)
+    api = FakeEmbeddingAPI()
+    pipeline = make_pipeline(api, EmbeddingCache(str(tmp_path / "cache.sqlite")))
+
+    results = asyncio.run(pipeline.embed(texts))
+
+    assert results == [vector(t) for t in texts]
+    assert sorted(len(batch) for batch in api.requests) == [1, 2, 2, 2]
+    assert pipeline.stats["embedded"] == len(texts)
+
+
+def test_retries_after_429(tmp_path, texts):
+    api = FakeEmbeddingAPI(fail_first=2)
+    pipeline = make_pipeline(api, EmbeddingCache(str(tmp_path / "cache.sqlite")))
+
+    results = asyncio.run(pipeline.embed(texts))
+
+    assert results == [vector(t) for t in texts]
+    assert pipeline.stats["retries"] == 2
+    assert len(api.requests) == 3
+
+
+def test_second_run_served_from_cache(tmp_path, texts):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"))
+    first = make_pipeline(FakeEmbeddingAPI(), cache)
+    asyncio.run(first.embed(texts))
+
+    api = FakeEmbeddingAPI()
+    second = make_pipeline(api, EmbeddingCache(str(tmp_path / "cache.sqlite")))
+    results = asyncio.run(second.embed(texts))
+
+    assert results == [vector(t) for t in texts]
+    assert api.requests == []
+    assert second.stats["cached"] == len(texts)
@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+from setup_graph import GraphManager, RoadInVersaillesAgent, State
+
+CONTEXT = "CONTEXTE PRÉCHARGÉ"
+INFO = {"date": "2026-10-18", "hour": "10:00", "group_type": "famille", "time_of_visit": "3", "budget": None}
+INTENT = {"user_wants_road_in_versailles": True, "user_wants_specific_info": False, "user_asks_off_topic": False}
+ROAD = {"response": "Commencez par la galerie des Glaces."}
+
+
+@pytest.fixture
+def searches(monkeypatch):
+    """
+    Remplace la recherche RAG : renvoie CONTEXT et compte les appels
+    """
+    calls = []
+
+    async def asearch(query):
+        calls.append(query)
+        return CONTEXT
+
+    monkeypatch.setattr(RoadInVersaillesAgent, "asearch", staticmethod(asearch))
+    return calls
+
+
+@pytest.fixture
+def prefetched(monkeypatch):
+    """
+    Enregistre ce que RoadInVersaillesAgent.prefetched_context renvoie au noeud de l'itinéraire
+    """
+    results = []
+    original = RoadInVersaillesAgent.prefetched_context
+
+    def prefetched_context(state, query_client):
+        results.append(original(state, query_client))
+        return results[-1]
+
+    monkeypatch.setattr(RoadInVersaillesAgent, "prefetched_context", staticmethod(prefetched_context))
+    return results
+
+
+def answers(itinerary_info):
+    return [
+        ("additional information about the castle", ROAD),
+        ("analyzes user messages to determine their", INTENT),
+        ("specialised in creating plans", {"response": "Merci !", "necessary_info_for_road": itinerary_info}),
+    ]
+
+
+def run_turn(message):
+    state = State(
+        messages=[HumanMessage(content="Je veux visiter le château"), AIMessage(content="Quel est votre budget ?"),
+                  HumanMessage(content=message)],
+        necessary_info_for_road=dict(INFO),
+        user_wants_road_in_versailles=True,
+    )
+    return asyncio.run(GraphManager().arun_agent(state))
+
+
+def road_prompt(fake):
+    return next(r["messages"][0]["content"] for r in fake.requests
+                if "additional information about the castle" in r["messages"][0]["content"])
+
+
+def test_last_slot_from_parser(fake_mistral, searches, prefetched):
+    fake_mistral.answers = answers({**INFO, "budget": "50 € par personne"})
+    result = run_turn("50 euros par personne")
+
+    assert result["messages"][-1].content == ROAD["response"]
+    # Recherche lancée par ItineraryInfoAgent et reprise par RoadInVersaillesAgent
+    assert len(searches) == 1
+    assert len(prefetched) == 1 and isinstance(prefetched[0], asyncio.Task)
+    assert CONTEXT in road_prompt(fake_mistral)
+
+
+def test_last_slot_from_llm(fake_mistral, searches, prefetched):
+    fake_mistral.answers = answers({**INFO, "budget": "modéré"})
+    result = run_turn("un budget plutôt modéré")
+
+    assert result["necessary_info_for_road"]["budget"] == "modéré"
+    # Recherche lancée par ItineraryInfoAgent et reprise par RoadInVersaillesAgent
+    assert len(searches) == 1
+    assert len(prefetched) == 1 and isinstance(prefetched[0], asyncio.Task)
+    assert CONTEXT in road_prompt(fake_mistral)
+
+
+def test_prefetched_context_matches_query(searches):
+    info = {**INFO, "budget": "50 €"}
+    query = RoadInVersaillesAgent.format_query(info)
+
+    async def run():
+        prefetch = RoadInVersaillesAgent.prefetch(info)
+        state = State(necessary_info_for_road=info, rag_context=prefetch)
+        task = RoadInVersaillesAgent.prefetched_context(state, query)
+        other = RoadInVersaillesAgent.prefetched_context(state, query + " autre")
+        return task is prefetch["task"], await task, other
+
+    assert asyncio.run(run()) == (True, CONTEXT, None)
+    assert searches == [query]
+
+
+def test_prefetch_cancelled_when_info_changes(searches):
+    info = {**INFO, "budget": "50 €"}
+
+    async def run():
+        first = RoadInVersaillesAgent.prefetch(info)
+        same = RoadInVersaillesAgent.prefetch(dict(info), first)
+        second = RoadInVersaillesAgent.prefetch({**info, "budget": "100 €"}, first)
+        await asyncio.sleep(0)
+        return same is first, first["task"].cancelled(), second["query"] != first["query"]
+
+    assert asyncio.run(run()) == (True, True, True)
@@ -0,0 +1,53 @@
+import asyncio
+import json
+
+import httpx
+
+INTENT = {"user_wants_road_in_versailles": False, "user_wants_specific_info": True, "user_asks_off_topic": False}
+MESSAGE = "Parle-moi de la galerie des Glaces, quand a-t-elle été construite ?"
+
+
+def test_duplicate_across_endpoints(fake_mistral):
+    fake_mistral.answers = [
+        ("analyzes user messages to determine their", INTENT),
+        ("", {"response": "Entre 1678 et 1684."}),
+    ]
+    fake_mistral.delay = 0.05
+    import app as backend
+
+    async def run():
+        transport = httpx.ASGITransport(app=backend.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            payload = {"message": MESSAGE, "session_id": "double"}
+            return await asyncio.gather(client.post("/", json=payload), client.post("/stream", json=payload))
+
+    chat, stream = asyncio.run(run())
+
+    # Même message envoyé en parallèle sur les deux endpoints : chacun reçoit son propre format
+    assert chat.status_code == 200
+    assert chat.json()["response"] == "Entre 1678 et 1684."
+    events = [json.loads(line[len("data: "):]) for line in stream.text.splitlines() if line.startswith("data: ")]
+    assert events[-1]["event"] == "done"
+    assert events[-1]["response"] == "Entre 1678 et 1684."
+    # Les deux tours ont été joués l'un après l'autre dans la session
+    state = backend.sessions.get("double")
+    assert [m.content for m in state.messages if m.type == "human"] == [MESSAGE, MESSAGE]
+
+
+def test_duplicate_on_same_endpoint_is_coalesced():
+    from sessions import SessionStore
+
+    store = SessionStore(backend=None)
+    calls = []
+
+    async def turn(state):
+        calls.append(state)
+        await asyncio.sleep(0.01)
+        return "réponse"
+
+    async def run():
+        return await asyncio.gather(store.run_turn("s", "bonjour", turn), store.run_turn("s", "bonjour", turn))
+
+    assert asyncio.run(run()) == ["réponse", "réponse"]
+    assert len(calls) == 1
+    assert store.info()["coalesced"] == 1
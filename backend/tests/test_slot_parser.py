@@ -0,0 +1,105 @@
+from datetime import date
+
+import pytest
+
+from slot_parser import parse_slots, is_fully_parsed, next_question
+
+# Samedi 17 octobre 2026
+TODAY = date(2026, 10, 17)
+
+
+def parse(text, expected=None):
+    slots, residual = parse_slots(text, today=TODAY, expected=expected)
+    return slots, is_fully_parsed(residual)
+
+
+@pytest.mark.parametrize("text, expected, slots", [
+    ("demain vers 10h", None, {"date": "2026-10-18", "hour": "10:00"}),
+    ("le 12 mai à 10h", None, {"date": "2027-05-12", "hour": "10:00"}),
+    ("en famille", "group_type", {"group_type": "famille"}),
+    ("2 adultes et 3 enfants", "group_type", {"group_type": "famille"}),
+    ("3h", "time_of_visit", {"time_of_visit": "3"}),
+    ("une demi-journée", "time_of_visit", {"time_of_visit": "4"}),
+    ("50 euros par personne", "budget", {"budget": "50 € par personne"}),
+    ("tomorrow at 10:30am", None, {"date": "2026-10-18", "hour": "10:30"}),
+])
+def test_fully_parsed_answers(text, expected, slots):
+    assert parse(text, expected) == (slots, True)
+
+
+@pytest.mark.parametrize("text", [
+    # Jour sans mois : le nombre n'est pas compris, le LLM doit le voir
+    "le 12 à 10h",
+    "je viens le 12 avec 2 enfants",
+    "le 3 à 10h",
+])
+def test_leftover_number_goes_to_llm(text):
+    _, fully_parsed = parse(text)
+    assert not fully_parsed
+
+
+@pytest.mark.parametrize("text, hour", [
+    ("3h", "15:00"),
+    ("à 2h30", "14:30"),
+    ("8h30", "08:30"),
+    ("10h", "10:00"),
+    ("3 am", "03:00"),
+])
+def test_afternoon_hours(text, hour):
+    slots, _ = parse(text, expected="hour")
+    assert slots["hour"] == hour
+
+
+def test_ambiguous_hour_left_empty():
+    slots, _ = parse("3h")
+    assert "hour" not in slots and "time_of_visit" not in slots
+
+
+def test_next_question():
+    info = {"date": "2026-10-18", "hour": None, "group_type": None, "time_of_visit": None, "budget": None}
+    assert "heure" in next_question(info, "fr")
+
+
+@pytest.mark.parametrize("text, slots", [
+    ("de 10h à 12h", {"hour": "10:00", "time_of_visit": "2"}),
+    ("de 14h à 17h", {"hour": "14:00", "time_of_visit": "3"}),
+    ("de 9h30 à midi", {"hour": "09:30", "time_of_visit": "2.5"}),
+    ("entre 14h et 17h", {"hour": "14:00", "time_of_visit": "3"}),
+    ("from 9am to noon", {"hour": "09:00", "time_of_visit": "3"}),
+])
+def test_time_ranges(text, slots):
+    assert parse(text) == (slots, True)
+
+
+def test_reversed_time_range_goes_to_llm():
+    slots, fully_parsed = parse("de 17h à 10h")
+    assert slots == {} and not fully_parsed
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("demain après-midi", None),
+    ("samedi après-midi", None),
+    ("in the morning", "hour"),
+    ("dans la matinée", "time_of_visit"),
+])
+def test_time_of_day_left_to_llm(text, expected):
+    slots, fully_parsed = parse(text, expected)
+    assert "hour" not in slots and "time_of_visit" not in slots
+    assert not fully_parsed
+
+
+@pytest.mark.parametrize("text", ["sans enfants", "pas d'enfants", "without kids", "no children"])
+def test_negated_group_type(text):
+    slots, fully_parsed = parse(text, "group_type")
+    assert "group_type" not in slots
+    assert not fully_parsed
+
+
+def test_eval_prefill_does_not_guess_time_of_day():
+    from langchain_core.messages import HumanMessage
+    from setup_graph import ItineraryInfoAgentEval, State
+
+    state = State(messages=[HumanMessage(content="Visite demain après-midi en famille, budget 50 €")])
+    info, _ = ItineraryInfoAgentEval.prefill(state)
+    # L'heure et la durée manquent : l'agent d'évaluation appellera le LLM
+    assert info["hour"] is None and info["time_of_visit"] is None
@@ -0,0 +1,40 @@
+import asyncio
+
+from setup_graph import GraphManager, State, astream_to_agent
+
+INTENT = {"user_wants_road_in_versailles": False, "user_wants_specific_info": True, "user_asks_off_topic": False}
+ANSWER = "La galerie des Glaces a été construite entre 1678 et 1684 par Jules Hardouin-Mansart."
+
+
+def collect(mgr, message):
+    async def run():
+        return [event async for event in astream_to_agent(State(), mgr, message)]
+    return asyncio.run(run())
+
+
+def test_answer_streams_in_several_tokens(fake_mistral):
+    fake_mistral.answers = [
+        ("analyzes user messages to determine their", INTENT),
+        ("", {"response": ANSWER}),
+    ]
+    events = collect(GraphManager(), "Parle-moi de la galerie des Glaces, quand a-t-elle été construite ?")
+
+    tokens = [event for event in events if event["event"] == "token"]
+    assert events[-1]["event"] == "done"
+    assert events[-1]["response"] == ANSWER
+    # Réponse envoyée progressivement, avant l'événement final
+    assert len(tokens) >= 5
+    assert {event["node"] for event in tokens} == {"specific_info_agent"}
+    assert "".join(event["delta"] for event in tokens) == ANSWER
+
+
+def test_agents_request_json_mode(fake_mistral):
+    fake_mistral.answers = [
+        ("analyzes user messages to determine their", INTENT),
+        ("", {"response": ANSWER}),
+    ]
+    collect(GraphManager(), "Parle-moi de la galerie des Glaces, quand a-t-elle été construite ?")
+
+    agent_request = fake_mistral.requests[-1]
+    assert agent_request["response_format"] == {"type": "json_object"}
+    assert not agent_request.get("tools")
@@ -1,5 +1,7 @@
 import streamlit as st
 import requests
+import json
+import uuid
 from pathlib import Path
 from components import get_header, get_user_message, get_assistant_message, get_loading_spinner
 
@@ -29,30 +31,72 @@ st.write(INIT_MESSAGE)
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
+# Identifiant de session : le backend garde une conversation par session_id
+if "session_id" not in st.session_state:
+    st.session_state.session_id = str(uuid.uuid4())
+
 # Initialiser l'état de traitement
 if "processing" not in st.session_state:
     st.session_state.processing = False
 
+# Afficher l'historique avec des conteneurs stylisés
+for msg in st.session_state.messages:
+    if msg["role"] == "user":
+        st.markdown(get_user_message(msg['content']), unsafe_allow_html=True)
+    else:
+        st.markdown(get_assistant_message(msg['content']), unsafe_allow_html=True)
+
+
+def iter_sse_events(response):
+    """Lit une réponse Server-Sent Events et génère les données (JSON) de chaque événement"""
+    data = []
+    for line in response.iter_lines(decode_unicode=True):
+        if line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+        elif not line and data:
+            # Ligne vide : fin de l'événement
+            yield json.loads("\n".join(data))
+            data = []
+    if data:
+        yield json.loads("\n".join(data))
+
+
 # Si en cours de traitement, appeler l'IA
 if st.session_state.processing:
-    # Afficher le spinner
-    spinner_placeholder = st.empty()
-    spinner_placeholder.markdown(get_loading_spinner(), unsafe_allow_html=True)
+    # Le spinner est remplacé par la bulle de réponse dès le premier morceau reçu
+    answer_placeholder = st.empty()
+    answer_placeholder.markdown(get_loading_spinner(), unsafe_allow_html=True)
 
     # Récupérer le dernier message utilisateur
     last_user_message = st.session_state.messages[-1]["content"]
 
     try:
-        # Appel à ton backend FastAPI
-        response = requests.post(f"{API_URL}/", json={"message": last_user_message})
-        if response.status_code == 200:
-            answer = response.json().get("response", "Pas de réponse.")
-            # Ajouter la réponse de l'IA à l'historique
-            st.session_state.messages.append({"role": "assistant", "content": answer})
-        else:
-            st.session_state.messages.append(
-                {"role": "assistant", "content": f"Erreur {response.status_code} : {response.text}"}
-            )
+        # Appel à ton backend FastAPI, réponse streamée
+        with requests.post(f"{API_URL}/stream", json={"message": last_user_message, "session_id": st.session_state.session_id}, stream=True) as response:
+            if response.status_code == 200:
+                partial = ""
+                partial_node = None
+                answer = None
+                for event in iter_sse_events(response):
+                    if event["event"] == "token":
+                        # Nouvel agent (ex : itinéraire après la dernière question) : la bulle repart de zéro
+                        if event.get("node") != partial_node:
+                            partial, partial_node = "", event.get("node")
+                        partial += event["delta"]
+                        answer_placeholder.markdown(get_assistant_message(partial + "▌"), unsafe_allow_html=True)
+                    elif event["event"] == "done":
+                        answer = event.get("response") or partial or "Pas de réponse."
+                    elif event["event"] == "error":
+                        answer = event.get("detail", "Erreur de l'agent.")
+                # Flux interrompu avant l'événement final : garder ce qui a été reçu
+                if answer is None:
+                    answer = partial or "Pas de réponse."
+                # Ajouter la réponse de l'IA à l'historique
+                st.session_state.messages.append({"role": "assistant", "content": answer})
+            else:
+                st.session_state.messages.append(
+                    {"role": "assistant", "content": f"Erreur {response.status_code} : {response.text}"}
+                )
     except Exception as e:
         st.session_state.messages.append(
             {"role": "assistant", "content": f"Impossible de joindre le backend : {e}"}
@@ -60,16 +104,9 @@ if st.session_state.processing:
 
     # Arrêter le traitement
     st.session_state.processing = False
-    spinner_placeholder.empty()
+    answer_placeholder.empty()
     st.rerun()
 
-# Afficher l'historique avec des conteneurs stylisés
-for msg in st.session_state.messages:
-    if msg["role"] == "user":
-        st.markdown(get_user_message(msg['content']), unsafe_allow_html=True)
-    else:
-        st.markdown(get_assistant_message(msg['content']), unsafe_allow_html=True)
-
 # Formulaire pour gérer l'envoi avec Entrée
 with st.form(key="chat_form", clear_on_submit=True):
     col1, col2 = st.columns([6, 1])